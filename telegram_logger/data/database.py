@@ -5,7 +5,7 @@ import asyncio
 import json
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
 from .models import Message
 
 logger = logging.getLogger(__name__)
@@ -15,6 +15,8 @@ class DatabaseManager:
         self.db_path = db_path
         self.conn = self._init_db()
         self.conn.row_factory = sqlite3.Row
+        # message_id -> 等待该消息落库的 Future，写入后只唤醒对应 ID 的等待者
+        self._row_waiters: Dict[int, List[asyncio.Future]] = {}
 
     def _init_db(self):
         """Initialize database connection and create tables"""
@@ -102,6 +104,7 @@ class DatabaseManager:
                 params
             )
             self.conn.commit()
+            self._notify_new_rows((message.id,))
             logger.debug(f"Message saved: MsgID={message.id} ChatID={message.chat_id}")
         except sqlite3.IntegrityError:
             logger.warning(f"Duplicate message ignored: MsgID={message.id} ChatID={message.chat_id}")
@@ -113,22 +116,96 @@ class DatabaseManager:
             logger.error(f"保存消息时发生意外错误 (MsgID={message.id} ChatID={message.chat_id}): {e}", exc_info=True)
             self.conn.rollback() # Ensure rollback on any exception
 
+    def _notify_new_rows(self, message_ids: Iterable[int]) -> None:
+        """唤醒正在等待这些消息 ID 落库的协程，其他等待者不受影响。"""
+        if not self._row_waiters:
+            return
+        for message_id in message_ids:
+            for waiter in self._row_waiters.pop(message_id, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def wait_for_message(self, message_id: int, timeout: float) -> bool:
+        """等待指定 ID 的消息被写入数据库，最多 timeout 秒。被唤醒返回 True，超时返回 False。"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._row_waiters.setdefault(message_id, []).append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # 超时或被取消时从等待列表中移除；已被唤醒的列表已由 _notify_new_rows 取走
+            waiters = self._row_waiters.get(message_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._row_waiters[message_id]
+
+    def _query_message_by_id(self, conn, message_id: int) -> Optional[Message]:
+        """使用给定连接根据消息 ID 检索消息，数据库错误由调用方处理。"""
+        cursor = conn.cursor()
+        # 获取与该消息 ID 关联的最早记录（通常是原始消息）
+        cursor.execute("SELECT * FROM messages WHERE id = ? ORDER BY created_time ASC LIMIT 1", (message_id,))
+        row = cursor.fetchone()
+        if row:
+            return self._row_to_message(row)
+        logger.debug(f"在数据库中未找到消息 ID: {message_id}")
+        return None
+
     def get_message_by_id(self, message_id: int) -> Optional[Message]:
         """根据消息 ID 从数据库检索消息。"""
         try:
-            cursor = self.conn.cursor()
-            # 获取与该消息 ID 关联的最早记录（通常是原始消息）
-            cursor.execute("SELECT * FROM messages WHERE id = ? ORDER BY created_time ASC LIMIT 1", (message_id,))
-            row = cursor.fetchone()
-            if row:
-                return self._row_to_message(row)
-            else:
-                logger.debug(f"在数据库中未找到消息 ID: {message_id}")
-                return None
+            return self._query_message_by_id(self.conn, message_id)
         except sqlite3.Error as e:
             logger.error(f"从数据库检索消息 ID {message_id} 时出错: {e}", exc_info=True)
             return None
 
+    async def get_message_by_id_async(self, message_id: int) -> Optional[Message]:
+        """在线程中根据消息 ID 检索消息，避免阻塞事件循环。"""
+        def _sync_get() -> Optional[Message]:
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                return self._query_message_by_id(conn, message_id)
+            except sqlite3.Error as e:
+                logger.error(f"从数据库检索消息 ID {message_id} 时出错: {e}", exc_info=True)
+                return None
+            finally:
+                if conn:
+                    conn.close()
+        return await asyncio.to_thread(_sync_get)
+
+    async def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Message]:
+        """批量检索多条消息，返回 {消息 ID: 最早记录}，未找到的 ID 不出现在结果中。"""
+        def _sync_get() -> Dict[int, Message]:
+            messages: Dict[int, Message] = {}
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                ids = list(message_ids)
+                # 分块查询，避免超出 SQLite 的参数数量上限
+                for start in range(0, len(ids), self.MAX_QUERY_PARAMS):
+                    chunk = ids[start:start + self.MAX_QUERY_PARAMS]
+                    cursor = conn.execute(
+                        f"SELECT * FROM messages WHERE id IN ({','.join('?' * len(chunk))}) "
+                        "ORDER BY created_time ASC",
+                        chunk
+                    )
+                    for row in cursor:
+                        # 与 get_message_by_id 一致，每个 ID 只保留最早的记录（通常是原始消息）
+                        if row['id'] not in messages:
+                            messages[row['id']] = self._row_to_message(row)
+            except sqlite3.Error as e:
+                logger.error(f"批量检索消息 (IDs={message_ids}) 时数据库出错: {e}", exc_info=True)
+            finally:
+                if conn:
+                    conn.close()
+            return messages
+        return await asyncio.to_thread(_sync_get)
+
     def get_messages(
         self, 
         chat_id: int, 
@@ -662,6 +739,9 @@ class DatabaseManager:
         'bot': 4
     }
 
+    # 单条 IN (...) 查询允许的最大参数个数
+    MAX_QUERY_PARAMS = 500
+
     async def set_model_alias(self, alias: str, model_id: str) -> bool:
         """设置模型别名。"""
         def _sync_set() -> bool:
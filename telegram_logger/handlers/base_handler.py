@@ -10,6 +10,8 @@ from telegram_logger.data.models import Message
 logger = logging.getLogger(__name__)
 
 class BaseHandler(abc.ABC):
+    # 声明基类属性槽位，子类可继续声明自己的 __slots__ 以获得更快的属性访问
+    __slots__ = ("client", "db", "log_chat_id", "ignored_ids", "_my_id")
 
     def __init__(
         self, 
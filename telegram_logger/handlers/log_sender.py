@@ -1,6 +1,7 @@
 import logging
-from typing import Optional
+from typing import List, Optional
 from telethon.errors import MessageTooLongError, MediaCaptionTooLongError
+from telethon.tl.types import TypeMessageEntity
 
 logger = logging.getLogger(__name__)
 
@@ -10,14 +11,25 @@ class LogSender:
         self.log_chat_id = log_chat_id
         logger.info(f"LogSender initialized for chat_id: {self.log_chat_id}")
 
-    async def send_message(self, text: str, file=None, parse_mode: Optional[str] = None) -> bool:
-        """Sends a message or file to the log channel with error handling."""
+    async def send_message(
+        self,
+        text: str,
+        file=None,
+        parse_mode: Optional[str] = None,
+        formatting_entities: Optional[List[TypeMessageEntity]] = None,
+    ) -> bool:
+        """Sends a message or file to the log channel with error handling.
+
+        formatting_entities, when given, are sent as-is instead of parsing text
+        with parse_mode. Their offsets are in UTF-16 code units.
+        """
         try:
             await self.client.send_message(
                 self.log_chat_id,
                 text,
                 file=file,
-                parse_mode=parse_mode
+                parse_mode=parse_mode,
+                formatting_entities=formatting_entities,
             )
             logger.debug(f"Successfully sent message/file to log channel {self.log_chat_id}.")
             return True
@@ -27,12 +39,20 @@ class LogSender:
                 limit = 4090 # Slightly less than 4096 for safety
                 # Basic truncation, doesn't preserve markdown block structure perfectly if truncated within
                 truncated_text = text[:limit] + "... [TRUNCATED]"
+                truncated_entities = None
+                if formatting_entities is not None:
+                    # Keep only entities that still lie entirely inside the kept text
+                    kept_units = len(text[:limit].encode("utf-16-le")) // 2
+                    truncated_entities = [
+                        e for e in formatting_entities if e.offset + e.length <= kept_units
+                    ]
 
                 await self.client.send_message(
                     self.log_chat_id,
                     truncated_text,
                     file=file, # Still try sending file if present
-                    parse_mode=parse_mode # Keep original parse mode if possible
+                    parse_mode=parse_mode, # Keep original parse mode if possible
+                    formatting_entities=truncated_entities,
                 )
                 logger.info("Successfully sent truncated message to log channel.")
                 return True # Count as success even if truncated
@@ -49,7 +69,7 @@ class LogSender:
                 caption_warning = "\n\n[Caption was too long and sent separately]"
                 text_with_warning = text + caption_warning
                 # Attempt to send the modified text (could trigger MessageTooLongError again)
-                return await self.send_message(text=text_with_warning, parse_mode=parse_mode) # Recursive call handles potential MessageTooLongError
+                return await self.send_message(text=text_with_warning, parse_mode=parse_mode, formatting_entities=formatting_entities) # Recursive call handles potential MessageTooLongError
             except Exception as e_fallback:
                 logger.error(f"Failed during MediaCaptionTooLongError fallback: {e_fallback}", exc_info=True)
                 await self._send_minimal_error(f"⚠️ Error: Media caption was too long, and fallback failed: {type(e_fallback).__name__}")
@@ -1,8 +1,11 @@
+import asyncio
+import gc
 import logging
 import re
 import pickle
+import time
 from datetime import datetime
-from typing import Union, Optional
+from typing import Dict, Optional, Set, Tuple, Union
 from telethon import events
 from telethon.tl.types import Message
 from telegram_logger.handlers.base_handler import BaseHandler
@@ -10,94 +13,188 @@ from telegram_logger.utils.media import save_media_as_file
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# 环境变量已就绪（例如已由其他模块加载过）时跳过 .env 的重复读取与解析
+if "LOG_CHAT_ID" not in os.environ:
+    load_dotenv(override=False)
 LOG_CHAT_ID = int(os.getenv("LOG_CHAT_ID", "-1002268819123"))
-IGNORED_IDS = {int(x.strip()) for x in os.getenv("IGNORED_IDS", "-10000").split(",")}
+# 使用不可变的 frozenset，导入后不会再被修改
+IGNORED_IDS = frozenset(int(x.strip()) for x in os.getenv("IGNORED_IDS", "-10000").split(","))
+
+# 预编译 t.me 链接的正则，避免每条消息都经过 re 模块的缓存查找
+# 仅通过 .match() 使用，本身已锚定在开头，因此模式中不再写 ^
+_TME_LINK_RE = re.compile(r"(?:https:\/\/)?t\.me\/(?:c\/)?[\w\d]+\/\d+")
+_TME_LINK_PREFIXES = ("https://t.me/", "t.me/")
+# tg://openmessage 链接只是固定前缀加两个整数字段，手写检查即可，无需正则
+_TG_OPENMSG_PREFIX = "tg://openmessage?user_id="
+_TG_OPENMSG_SEP = "&message_id="
+# 所有特殊链接的前缀，用一次 C 层的 startswith 快速排除普通文本
+_LINK_PREFIXES = _TME_LINK_PREFIXES + (_TG_OPENMSG_PREFIX,)
+
+# media 字段中 TL 二进制数据的格式标记；未带标记的旧数据均为 pickle
+# (pickle 协议 2 及以上的输出总以 b"\x80" 开头，不会与该标记冲突)
+_MEDIA_TL_TAG = b"tl:"
+
+
+def _is_openmessage_link(text: str) -> bool:
+    """检查 text 是否以 tg://openmessage?user_id=<数字>&message_id=<数字> 开头"""
+    if not text.startswith(_TG_OPENMSG_PREFIX):
+        return False
+    user_id, sep, rest = text[len(_TG_OPENMSG_PREFIX):].partition(_TG_OPENMSG_SEP)
+    return bool(sep) and user_id.isdecimal() and rest[:1].isdecimal()
+
+
+# 聊天级 noforwards 标志的缓存：过期后重新读取，以便感知"限制保存内容"设置的变化
+_NOFORWARDS_CACHE_TTL = 300.0  # 单位：秒
+_NOFORWARDS_CACHE_MAXSIZE = 1024
 
 logger = logging.getLogger(__name__)
 
 
 class NewMessageHandler(BaseHandler):
+    """
+    旧版新消息处理器，已由 PersistenceHandler 取代。
+    注意：该类未实现 process()，也未在 main.py 中注册，且构造的 Message 参数
+    (media=...) 与 data.models.Message 不符，当前不会在运行时被执行。
+    """
+
+    __slots__ = (
+        "persist_times",
+        "_log_chat_id",
+        "_noforwards_cache",
+        "_background_tasks",
+    )
+
     def __init__(self, client, db, log_chat_id, ignored_ids, persist_times):
         super().__init__(client, db, log_chat_id, ignored_ids)
         self.persist_times = persist_times
+        self._log_chat_id = log_chat_id
+        # chat_id -> (过期时间 monotonic, 聊天级别的 noforwards 标志)
+        self._noforwards_cache: Dict[int, Tuple[float, bool]] = {}
+        # 持有后台任务的强引用，防止任务在执行途中被垃圾回收
+        self._background_tasks: Set[asyncio.Task] = set()
 
     async def handle_new_message(
         self, event: events.NewMessage.Event # 明确处理 NewMessage 事件
     ) -> Optional[Message]:
         """处理新接收到的消息"""
-        # 添加类型检查以确保事件类型正确（虽然注册时已指定）
-        if not isinstance(event, events.NewMessage.Event):
+        # 注册时已指定事件类型，类型检查仅在调试模式下执行（python -O 会将其移除）
+        if __debug__ and not isinstance(event, events.NewMessage.Event):
             logger.warning(f"NewMessageHandler received non-NewMessage event: {type(event)}")
             # 根据 Telethon 的期望，可能返回 None 或不返回
             return None
+        # 一次性取出后续各步骤都要用到的字段，避免重复的属性链访问
+        msg = event.message
         chat_id = event.chat_id
-        from_id = self._get_sender_id(event.message)
-        msg_id = event.message.id
+        from_id = self._get_sender_id(msg)
+        text = msg.text
 
-        if await self._should_ignore_message(event, chat_id, from_id):
+        if self._should_ignore_message(chat_id, from_id, text):
             return None
 
-        message = await self._create_message_object(event)
-        await self.db.save_message(message)
+        message = await self._create_message_object(event, msg, chat_id, from_id)
+        await self.save_message(message)
         return message
 
-    async def _should_ignore_message(self, event, chat_id, from_id) -> bool:
+    def _should_ignore_message(self, chat_id, from_id, text) -> bool:
         """判断是否应该忽略消息"""
-        if await self._is_special_link_message(event, chat_id, from_id):
-            return True
-        return from_id in IGNORED_IDS or chat_id in IGNORED_IDS
-
-    async def _is_special_link_message(self, event, chat_id, from_id) -> bool:
-        """处理特殊消息链接"""
-        if (
-            chat_id == LOG_CHAT_ID
-            and from_id == self.my_id
-            and event.message.text
-            and (
-                re.match(
-                    r"^(https:\/\/)?t\.me\/(?:c\/)?[\d\w]+\/[\d]+", event.message.text
-                )
-                or re.match(
-                    r"^tg:\/\/openmessage\?user_id=\d+&message_id=\d+",
-                    event.message.text,
-                )
-            )
-        ):
-            await self._save_restricted_messages(event.message.text)
+        # 只有日志频道中自己发送的消息才可能是特殊链接，其余消息不必进入链接检查
+        if self._is_own_log_chat_message(chat_id, from_id):
+            if self._is_special_link_message(text):
+                # 保存受限消息放到后台任务中执行，不阻塞当前消息的处理
+                task = asyncio.create_task(self._save_restricted_messages(text))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                return True
+        ignored = IGNORED_IDS
+        return from_id in ignored or chat_id in ignored
+
+    def _is_own_log_chat_message(self, chat_id, from_id) -> bool:
+        """判断消息是否为自己在日志频道中发送的"""
+        # 单次元组比较代替两次链式比较；my_id 尚未由 init() 获取时为 None，不会匹配
+        return (chat_id, from_id) == (self._log_chat_id, self._my_id)
+
+    @staticmethod
+    def _is_special_link_message(text) -> bool:
+        """判断消息文本是否为特殊消息链接，调用方需先确认是自己在日志频道中发送的消息"""
+        if not text or not text.startswith(_LINK_PREFIXES):
+            return False
+        if _is_openmessage_link(text):
             return True
-        return False
+        # 前缀已命中，再用正则对 t.me 链接做精确校验
+        return _TME_LINK_RE.match(text) is not None
 
-    async def _create_message_object(self, event: events.NewMessage.Event) -> Message: # 类型提示更精确
+    async def _create_message_object(
+        self, event: events.NewMessage.Event, msg, chat_id, from_id
+    ) -> Message: # 类型提示更精确
         """创建消息对象"""
-        noforwards = getattr(event.chat, "noforwards", False) or getattr(
-            event.message, "noforwards", False
-        )
-        self_destructing = bool(
-            getattr(getattr(event.message, "media", None), "ttl_seconds", False)
+        msg_media = msg.media
+        noforwards = self._get_chat_noforwards(event, chat_id) or getattr(
+            msg, "noforwards", False
         )
+        self_destructing = bool(getattr(msg_media, "ttl_seconds", False))
 
         media = None
-        if event.message.media or (noforwards or self_destructing):
+        if msg_media or (noforwards or self_destructing):
             try:
-                media_path = await save_media_as_file(self.client, event.message)
-                media = pickle.dumps(event.message.media)
+                # 序列化只需数微秒，直接在事件循环线程中执行：切换到线程池的开销更大，
+                # 且 _serialize_media 会切换进程级的 GC 开关，不能在工作线程中并发调用
+                media = self._serialize_media(msg_media)
+                media_path = await save_media_as_file(self.client, msg)
             except Exception as e:
                 logger.error(f"保存媒体失败: {str(e)}")
 
         return Message(
-            id=event.message.id,
-            from_id=self._get_sender_id(event.message),
-            chat_id=event.chat_id,
+            id=msg.id,
+            from_id=from_id,
+            chat_id=chat_id,
             msg_type=await self._get_chat_type(event),
-            msg_text=event.message.message,
+            msg_text=msg.message,
             media=media,
             noforwards=noforwards,
             self_destructing=self_destructing,
-            created_time=datetime.now(), # 新消息的创建时间
+            # 复用消息自带的发送时间，无需再读取系统时钟（与 PersistenceHandler 一致）
+            created_time=msg.date or datetime.now(), # 新消息的创建时间
             edited_time=None, # 新消息没有编辑时间
         )
 
+    def _get_chat_noforwards(self, event: events.NewMessage.Event, chat_id) -> bool:
+        """获取聊天级别的 noforwards 标志，按 chat_id 缓存 _NOFORWARDS_CACHE_TTL 秒"""
+        now = time.monotonic()
+        cache = self._noforwards_cache
+        cached = cache.get(chat_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        chat = event.chat
+        noforwards = bool(getattr(chat, "noforwards", False))
+        # 聊天实体尚未解析时不缓存，下次再取
+        if chat is not None:
+            if chat_id not in cache and len(cache) >= _NOFORWARDS_CACHE_MAXSIZE:
+                # 淘汰最早加入的条目
+                cache.pop(next(iter(cache)))
+            cache[chat_id] = (now + _NOFORWARDS_CACHE_TTL, noforwards)
+        return noforwards
+
+    @staticmethod
+    def _serialize_media(media) -> bytes:
+        """序列化媒体元数据。
+
+        优先使用 Telethon 自带的 TL 二进制序列化（紧凑且不会执行代码），
+        并加上 _MEDIA_TL_TAG 前缀以便读取方区分格式（去掉前缀后用
+        BinaryReader.tgread_object() 还原）；失败时回退到 pickle。
+        序列化期间暂停 GC，避免嵌套媒体（缩略图、文档属性等）产生的
+        大量临时对象在调用中途触发分代回收。
+        """
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            try:
+                return _MEDIA_TL_TAG + bytes(media)
+            except (TypeError, ValueError):
+                return pickle.dumps(media)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
     async def _save_restricted_messages(self, link: str):
         """保存受限消息"""
         # 实现类似原save_restricted_msg的功能
@@ -1,11 +1,13 @@
 import asyncio
+import functools
 import logging
-from collections import deque
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Deque, Dict, List, Optional, Set, Union
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple, Union
 
 import telethon.errors
 from telethon import events
+from telethon.extensions import markdown
 from telethon.errors import (
     ChannelPrivateError,
     ChatAdminRequiredError,
@@ -20,21 +22,84 @@ from telethon.tl.types import (
     PeerChannel,
     PeerChat,
     PeerUser,
+    TypeMessageEntity,
 )
 
 from ..data.database import DatabaseManager
 from ..data.models import Message # 确保导入 Message
-# from ..utils.media import retrieve_media_as_file # retrieve_media_as_file 在 media_handler 中使用
-from ..utils.media import MAX_IN_MEMORY_FILE_SIZE
-from ..utils.mentions import create_mention
+from ..utils.media import MAX_IN_MEMORY_FILE_SIZE, retrieve_media_as_file
+from ..utils.mentions import create_mention, format_entity_mention
 from .base_handler import BaseHandler
-from contextlib import asynccontextmanager, contextmanager # 导入上下文管理器类型检查
 from .log_sender import LogSender
 from .media_handler import RestrictedMediaHandler
 from .message_formatter import MessageFormatter
 
 logger = logging.getLogger(__name__)
 
+# 合并发送文本日志时使用的分隔符与单条消息的长度上限
+# Telegram 的 4096 上限与实体偏移都按 UTF-16 码元计算，这里的上限同样以 UTF-16 码元为单位
+_LOG_BATCH_SEPARATOR = "\n\n───\n\n"
+_LOG_BATCH_MAX_UNITS = 3800
+
+
+def _utf16_len(text: str) -> int:
+    """返回文本的 UTF-16 码元数，即 Telegram 计算消息长度与实体偏移所用的单位。"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+_LOG_BATCH_SEPARATOR_UNITS = _utf16_len(_LOG_BATCH_SEPARATOR)
+
+# 提及所用实体的缓存：实体名称极少变化，缓存 10 分钟以省去重复的 get_entity 请求
+_ENTITY_CACHE_TTL = 600.0  # 单位：秒
+_ENTITY_CACHE_MAXSIZE = 2048
+
+# 同时进行的媒体发送数量上限
+_MEDIA_SEND_CONCURRENCY = 4
+
+# 转义消息正文中的 Markdown 特殊字符，单次 str.translate 即可完成
+# 不包含 [ 和 ]：Telethon 的 Markdown 解析不处理 \[ \]，转义后反斜杠会原样显示
+_MD_ESCAPE = str.maketrans({"*": "\\*", "_": "\\_", "`": "\\`"})
+
+
+# 超级群组/频道的 chat_id 以 -100 开头
+_CHANNEL_ID_PREFIX = "-100"
+
+
+@functools.lru_cache(maxsize=2048)
+def _chat_link_prefix(chat_id: int) -> Optional[str]:
+    """返回超级群组/频道 (-100 开头) 消息链接的前缀，普通群组与私聊返回 None。"""
+    chat_id_str = str(chat_id)
+    if not chat_id_str.startswith(_CHANNEL_ID_PREFIX):
+        return None
+    return f"https://t.me/c/{chat_id_str[len(_CHANNEL_ID_PREFIX):]}"
+
+
+def _fmt_utc(dt: datetime) -> str:
+    """将时间格式化为 'YYYY-MM-DD HH:MM:SS UTC'，比 strftime 更快。"""
+    if dt.tzinfo is not timezone.utc:
+        dt = dt.astimezone(timezone.utc)
+    return dt.isoformat(sep=" ", timespec="seconds")[:19] + " UTC"
+
+
+class _UnsupportedMessageData(TypeError):
+    """待格式化的消息既不是 Telethon Message 也不是数据库 Message。"""
+
+
+def _scan_media_attributes(media) -> Tuple[bool, str]:
+    """
+    单次遍历媒体属性，返回 (是否为贴纸, 文件名)。
+    Telethon 的 TL 类型不会被继承，因此用 type() is 做精确匹配即可。
+    """
+    is_sticker = False
+    file_name = ""
+    for attr in getattr(media, "attributes", ()) or ():
+        attr_type = type(attr)
+        if attr_type is DocumentAttributeSticker:
+            is_sticker = True
+        elif attr_type is DocumentAttributeFilename and not file_name:
+            file_name = attr.file_name or ""
+    return is_sticker, file_name
+
 
 class OutputHandler(BaseHandler):
     """
@@ -53,20 +118,49 @@ class OutputHandler(BaseHandler):
         deletion_rate_limit_threshold: int = 5,
         deletion_rate_limit_window: int = 10,  # 单位：秒
         deletion_pause_duration: int = 5,  # 单位：秒
+        log_batch_flush_interval: float = 2.0,  # 单位：秒
         my_id: Optional[int] = None, # 添加 my_id 参数
         **kwargs: Dict[str, Any],
     ):
         """初始化 OutputHandler。"""
         super().__init__(None, db, log_chat_id, ignored_ids, my_id=my_id, **kwargs) # 传递 my_id
-        self.forward_user_ids = set(forward_user_ids) if forward_user_ids else set()
-        self.forward_group_ids = set(forward_group_ids) if forward_group_ids else set()
+        # 规则集合在运行期间只读，冻结为 frozenset
+        self.forward_user_ids: FrozenSet[int] = frozenset(forward_user_ids or ())
+        self.forward_group_ids: FrozenSet[int] = frozenset(forward_group_ids or ())
+        self.ignored_ids: FrozenSet[int] = frozenset(self.ignored_ids or ())
 
         # 删除事件的速率限制配置
         self.deletion_rate_limit_threshold = deletion_rate_limit_threshold
-        self.deletion_rate_limit_window = timedelta(seconds=deletion_rate_limit_window)
-        self.deletion_pause_duration = timedelta(seconds=deletion_pause_duration)
-        self._deletion_timestamps: Deque[datetime] = deque()
-        self._rate_limit_paused_until: Optional[datetime] = None
+        # 热路径只做浮点运算：窗口与暂停时长以秒存储，时间戳取自 time.monotonic()
+        self._deletion_rate_limit_window_s = float(deletion_rate_limit_window)
+        self._deletion_pause_duration_s = float(deletion_pause_duration)
+        # 滑动窗口计数器：上一窗口与当前窗口的事件数及当前窗口起点，状态大小固定
+        self._deletion_prev_count = 0
+        self._deletion_curr_count = 0
+        self._deletion_window_start: Optional[float] = None
+        self._rate_limit_paused_until: Optional[float] = None
+        # 本次暂停是否已发送过通知，暂停结束时复位
+        self._pause_notified = False
+
+        # 文本日志合并缓冲区，由后台任务定期或在超长时发送
+        self.log_batch_flush_interval = log_batch_flush_interval
+        # 每条日志单独解析 Markdown 后以 (纯文本, 实体列表) 缓冲，互不影响格式
+        self._pending_texts: List[Tuple[str, List[TypeMessageEntity]]] = []
+        self._pending_units = 0
+        self._pending_lock = asyncio.Lock()
+        self._flusher_task: Optional[asyncio.Task] = None
+
+        # 带媒体的消息在后台任务中发送，由信号量限制并发数 (信号量在 set_client 中创建)
+        self._media_sem: Optional[asyncio.Semaphore] = None
+        self._inflight: Set[asyncio.Task] = set()
+        # chat_id -> 该聊天最后排队的媒体发送任务；同一聊天的发送串行，保持日志顺序
+        self._chat_tails: Dict[Optional[int], asyncio.Task] = {}
+
+        # 事件类型 -> 处理方法，在 set_client 中构建
+        self._dispatch: Dict[type, Any] = {}
+
+        # entity_id -> (过期时间 monotonic, 实体)
+        self._entity_cache: Dict[int, Tuple[float, Any]] = {}
 
         # 辅助类的占位符，将在 set_client 中初始化
         self.log_sender: Optional[LogSender] = None
@@ -75,11 +169,15 @@ class OutputHandler(BaseHandler):
 
         my_id_status = f"my_id={my_id}" if my_id is not None else "my_id 未提供 (将由 init 获取)"
         logger.info(
-            f"OutputHandler 初始化完毕。{my_id_status}, 转发用户: {self.forward_user_ids}, "
-            f"群组: {self.forward_group_ids}, 忽略 ID: {self.ignored_ids}, "
-            f"删除速率限制: {self.deletion_rate_limit_threshold} 事件 / "
-            f"{self.deletion_rate_limit_window.total_seconds()} 秒, 暂停: "
-            f"{self.deletion_pause_duration.total_seconds()} 秒"
+            "OutputHandler 初始化完毕。%s, 转发用户: %s, 群组: %s, 忽略 ID: %s, "
+            "删除速率限制: %s 事件 / %s 秒, 暂停: %s 秒",
+            my_id_status,
+            self.forward_user_ids,
+            self.forward_group_ids,
+            self.ignored_ids,
+            self.deletion_rate_limit_threshold,
+            self._deletion_rate_limit_window_s,
+            self._deletion_pause_duration_s,
         )
 
     def set_client(self, client):
@@ -96,6 +194,17 @@ class OutputHandler(BaseHandler):
             logger.info(
                 "OutputHandler 的辅助类 (LogSender, MessageFormatter, RestrictedMediaHandler) 已初始化。"
             )
+            if self._flusher_task is None:
+                self._flusher_task = asyncio.create_task(self._flusher())
+            if self._media_sem is None:
+                self._media_sem = asyncio.Semaphore(_MEDIA_SEND_CONCURRENCY)
+            # 按 type(event) 精确查表分发：MessageEdited.Event 虽继承自 NewMessage.Event，
+            # 但精确类型不同，无需再依赖 isinstance 的判断顺序
+            self._dispatch = {
+                events.NewMessage.Event: self._process_new_message,
+                events.MessageEdited.Event: self._process_edited_message,
+                events.MessageDeleted.Event: self._process_deleted_message,
+            }
         else:
             logger.warning("无法初始化 OutputHandler 辅助类：客户端为 None。")
 
@@ -115,32 +224,30 @@ class OutputHandler(BaseHandler):
             return None
 
         try:
-            # 这里的顺序不能改变，因为telethon的实现中，MessageEdited 是集成自NewMessage，如果改变了顺序，会导致无法触发修改和删除的事件
-            if isinstance(event, events.MessageEdited.Event):
-                await self._process_edited_message(event)
-            elif isinstance(event, events.MessageDeleted.Event):
-                await self._process_deleted_message(event)
-            elif isinstance(event, events.NewMessage.Event):
-                await self._process_new_message(event)
+            handler = self._dispatch.get(type(event))
+            if handler is not None:
+                await handler(event)
             else:
-                # 这个日志现在更有意义，因为它确认了前面的 isinstance 都没匹配上
                 logger.debug(
-                    f"OutputHandler ignored unknown event type: {type(event).__name__}"
+                    "OutputHandler ignored unknown event type: %s", type(event).__name__
                 )
             return None
         except Exception as e:
             # 这里的 event_type 同样只会是 "Event"，但结合错误信息和 msg_id 应该足够定位
             event_type = type(event).__name__
-            msg_id = getattr(event, "message_id", None)
-            if msg_id is None and hasattr(event, "deleted_ids"):
-                msg_id = event.deleted_ids
-            if msg_id is None and hasattr(event, "original_update"):
-                msg_id = getattr(
-                    getattr(event.original_update, "message", None), "id", "未知"
-                )
+            match event:
+                case events.MessageDeleted.Event(deleted_ids=deleted_ids):
+                    msg_id = deleted_ids
+                case events.NewMessage.Event(message=message):  # 也匹配 MessageEdited
+                    msg_id = getattr(message, "id", "未知")
+                case _:
+                    msg_id = getattr(event, "message_id", "未知")
 
             logger.exception(
-                f"OutputHandler 处理 {event_type} (相关消息ID: {msg_id}) 时发生严重错误: {e}"
+                "OutputHandler 处理 %s (相关消息ID: %s) 时发生严重错误: %s",
+                event_type,
+                msg_id,
+                e,
             )
             return None
 
@@ -149,23 +256,69 @@ class OutputHandler(BaseHandler):
     async def _process_new_message(self, event: events.NewMessage.Event):
         """处理新消息事件。"""
         if not self._should_forward(event):
-            logger.debug(f"新消息 {event.message.id} 不满足转发条件，已忽略。")
+            logger.debug("新消息 %s 不满足转发条件，已忽略。", event.message.id)
             return  # 不符合转发规则
 
-        logger.info(f"处理新消息: ChatID={event.chat_id}, MsgID={event.message.id}")
+        logger.info("处理新消息: ChatID=%s, MsgID=%s", event.chat_id, event.message.id)
         # 使用 OutputHandler 内部的格式化方法
         formatted_text = await self._format_output_message("新消息", event.message)
 
-        await self._send_message_with_media(formatted_text, event.message)
+        chat_id = event.chat_id
+        if not event.message.media or self._media_sem is None:
+            # 纯文本消息进入合并缓冲区，但须排在同一聊天此前的媒体消息之后
+            await self._wait_chat_sends(chat_id)
+            await self._send_message_with_media(formatted_text, event.message)
+            return
+
+        # 媒体上传耗时较长，放到后台任务中发送，不阻塞后续事件的处理。
+        # 不同聊天之间并发；同一聊天的任务依次等待前一个，保持该聊天内的日志顺序
+        previous = self._chat_tails.get(chat_id)
+        task = asyncio.create_task(
+            self._guarded_send(formatted_text, event.message, previous)
+        )
+        self._chat_tails[chat_id] = task
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        task.add_done_callback(functools.partial(self._release_chat_tail, chat_id))
+
+    async def _guarded_send(
+        self,
+        text: str,
+        message: TelethonMessage,
+        previous: Optional[asyncio.Task] = None,
+    ):
+        """等待同一聊天的上一条媒体发送完成后，在信号量限制下发送带媒体的消息。"""
+        if previous is not None:
+            await asyncio.wait((previous,))
+        async with self._media_sem:
+            await self._send_message_with_media(text, message)
+
+    def _release_chat_tail(self, chat_id: Optional[int], task: asyncio.Task):
+        """媒体发送任务结束时，若它仍是该聊天的最后一个任务则移除记录。"""
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def _wait_chat_sends(self, chat_id: Optional[int]):
+        """
+        等待该聊天已排队的媒体发送完成，使随后的文本日志不会早于它们发出。
+        chat_id 未知时等待所有聊天的媒体发送。
+        """
+        if chat_id is None:
+            pending = set(self._chat_tails.values())
+        else:
+            tail = self._chat_tails.get(chat_id)
+            pending = {tail} if tail is not None else set()
+        if pending:
+            await asyncio.wait(pending)
 
     async def _process_edited_message(self, event: events.MessageEdited.Event):
         """处理消息编辑事件。"""
         # 编辑事件也应用相同的转发规则
         if not self._should_forward(event):
-            logger.debug(f"编辑消息 {event.message.id} 不满足转发条件，已忽略。")
+            logger.debug("编辑消息 %s 不满足转发条件，已忽略。", event.message.id)
             return
 
-        logger.info(f"处理编辑消息: ChatID={event.chat_id}, MsgID={event.message.id}")
+        logger.info("处理编辑消息: ChatID=%s, MsgID=%s", event.chat_id, event.message.id)
         formatted_text = await self._format_output_message("编辑消息", event.message)
 
         # 决定编辑事件是否需要重新发送媒体。
@@ -173,7 +326,8 @@ class OutputHandler(BaseHandler):
         # 如果需要包含媒体，取消下面一行的注释，并确保 _send_message_with_media 能处理
         # await self._send_message_with_media(formatted_text, event.message)
         if self.log_sender:
-            await self.log_sender.send_message(formatted_text, parse_mode="markdown")
+            await self._wait_chat_sends(event.chat_id)
+            await self._enqueue_log(formatted_text)
         else:
             logger.error("LogSender 未初始化，无法发送编辑消息日志。")
 
@@ -181,28 +335,59 @@ class OutputHandler(BaseHandler):
         """处理消息删除事件。"""
         if not self._should_log_deletion(event):
             logger.debug(
-                f"删除事件 (IDs: {event.deleted_ids}, Chat: {event.chat_id}) 不满足记录条件，已忽略。"
+                "删除事件 (IDs: %s, Chat: %s) 不满足记录条件，已忽略。",
+                event.deleted_ids,
+                event.chat_id,
             )
             return  # 不符合记录删除的规则
 
         # 应用速率限制
         if not await self._apply_deletion_rate_limit():
             logger.warning(
-                f"删除事件被速率限制: IDs={event.deleted_ids}, Chat: {event.chat_id}"
+                "删除事件被速率限制: IDs=%s, Chat: %s",
+                event.deleted_ids,
+                event.chat_id,
             )
             return  # 被速率限制
 
         deleted_ids = event.deleted_ids
         chat_id = event.chat_id  # 可能为 None
 
-        logger.info(f"处理删除消息: ChatID={chat_id}, MsgIDs={deleted_ids}")
+        logger.info("处理删除消息: ChatID=%s, MsgIDs=%s", chat_id, deleted_ids)
 
-        for msg_id in deleted_ids:
-            # 从数据库检索原始消息，带重试逻辑
-            original_message = await self._get_message_from_db_with_retry(
-                msg_id, chat_id
+        # 先用一次批量查询取出所有已持久化的原始消息
+        found = await self.db.get_messages_by_ids(deleted_ids)
+        missing_ids = [msg_id for msg_id in deleted_ids if msg_id not in found]
+        # 只有缺失的 ID 才走带重试的单条查询，并发执行；批量查询刚刚未命中，直接等待写入
+        retried = await asyncio.gather(
+            *(
+                self._get_message_from_db_with_retry(
+                    msg_id, chat_id, skip_initial_lookup=True
+                )
+                for msg_id in missing_ids
             )
+        )
+        found.update(
+            (msg_id, message) for msg_id, message in zip(missing_ids, retried) if message
+        )
+
+        # 删除日志须排在该聊天此前的媒体消息之后
+        await self._wait_chat_sends(chat_id)
 
+        original_messages = []
+        for msg_id in deleted_ids:
+            message = found.get(msg_id)
+            if message and chat_id is not None and message.chat_id != chat_id:
+                logger.warning(
+                    "数据库中找到消息 %s，但其 chat_id (%s) 与事件 (%s) 不匹配。",
+                    msg_id,
+                    message.chat_id,
+                    chat_id,
+                )
+                message = None  # 视为未找到
+            original_messages.append(message)
+
+        for msg_id, original_message in zip(deleted_ids, original_messages):
             if original_message:
                 # 如果找到原始消息，格式化并发送日志
                 formatted_text = await self._format_output_message(
@@ -215,33 +400,31 @@ class OutputHandler(BaseHandler):
                 # media_path = original_message.media_path if not original_message.is_restricted else None # 示例
                 # await self.log_sender.send_message(formatted_text, file=media_path, parse_mode="markdown")
                 if self.log_sender:
-                    await self.log_sender.send_message(
-                        formatted_text, parse_mode="markdown"
-                    )
+                    await self._enqueue_log(formatted_text)
                 else:
                     logger.error("LogSender 未初始化，无法发送删除消息日志。")
             else:
                 # 如果数据库中找不到原始消息，发送一条简化的删除日志
                 logger.warning(
-                    f"无法从数据库检索到已删除消息 {msg_id} 的内容 (ChatID: {chat_id})。"
+                    "无法从数据库检索到已删除消息 %s 的内容 (ChatID: %s)。",
+                    msg_id,
+                    chat_id,
                 )
                 mention = f"消息 ID `{msg_id}`"
                 if chat_id and self.client:
                     try:
                         # 尝试创建聊天提及以提供上下文
-                        chat_mention = await create_mention(
-                            self.client, chat_id, msg_id
+                        chat_mention = await self._create_mention_cached(
+                            chat_id, msg_id
                         )  # 使用 msg_id 尝试生成链接
                         mention = f"{chat_mention} 中的消息 ID `{msg_id}`"
                     except Exception as e:
-                        logger.warning(f"为删除日志创建聊天 {chat_id} 提及失败: {e}")
+                        logger.warning("为删除日志创建聊天 %s 提及失败: %s", chat_id, e)
                         mention = f"聊天 `{chat_id}` 中的消息 ID `{msg_id}`"
 
                 formatted_text = f"🗑️ **删除消息 (内容未知)**\n\n{mention} 已被删除，但无法从数据库中检索到原始内容。"
                 if self.log_sender:
-                    await self.log_sender.send_message(
-                        formatted_text, parse_mode="markdown"
-                    )
+                    await self._enqueue_log(formatted_text)
                 else:
                     logger.error("LogSender 未初始化，无法发送内容未知的删除消息日志。")
 
@@ -254,48 +437,80 @@ class OutputHandler(BaseHandler):
         message = event.message
         if not message:
             logger.warning(
-                f"事件 {type(event).__name__} 没有有效的 message 对象，无法应用转发规则。"
+                "事件 %s 没有有效的 message 对象，无法应用转发规则。",
+                type(event).__name__,
             )
             return False
 
         sender_id = self._get_sender_id(message)  # 使用基类方法获取发送者 ID
         chat_id = message.chat_id
 
+        # 快速路径：既不是转发群组也不是转发用户的消息不可能被转发，
+        # 无需再读取 is_private/out/is_group 等需要计算的属性
+        if (
+            chat_id not in self.forward_group_ids
+            and sender_id not in self.forward_user_ids
+        ):
+            logger.debug(
+                "不转发消息 %s：发送者 %s 与聊天 %s 均不在转发列表中。",
+                message.id,
+                sender_id,
+                chat_id,
+            )
+            return False
+
+        # 注意：message.out 用于判断是否是自己发送的消息
+        is_incoming_private = message.is_private and not message.out
+        is_group = message.is_group  # 包括普通群组和超级群组
+
+        should_forward = self._forward_decision(
+            sender_id, chat_id, is_incoming_private, is_group
+        )
+        logger.debug(
+            "消息 %s 转发判定: %s (Sender: %s, Chat: %s, PrivateIn: %s, Group: %s)。",
+            message.id,
+            should_forward,
+            sender_id,
+            chat_id,
+            is_incoming_private,
+            is_group,
+        )
+        return should_forward
+
+    def _forward_decision(
+        self,
+        sender_id: int,
+        chat_id: Optional[int],
+        is_incoming_private: bool,
+        is_group: bool,
+    ) -> bool:
+        """根据提取出的字段计算转发判定。"""
         # 规则 1: 检查是否在忽略列表中
         if sender_id in self.ignored_ids:
-            logger.debug(f"忽略消息 {message.id}：发送者 {sender_id} 在忽略列表中。")
             return False
         # 对于群组/频道消息，也检查聊天 ID 是否在忽略列表
         if chat_id and chat_id in self.ignored_ids:
-            logger.debug(f"忽略消息 {message.id}：聊天 {chat_id} 在忽略列表中。")
             return False
 
-        # 规则 2: 检查是否满足转发条件
-        # 注意：message.out 用于判断是否是自己发送的消息
-        is_incoming_private = message.is_private and not message.out
-        is_group = message.is_group  # 包括普通群组和超级群组
-
-        # 条件 A: 来自指定用户的私聊消息 (非自己发送的)
-        if is_incoming_private and sender_id in self.forward_user_ids:
-            logger.debug(f"转发私聊消息 {message.id}，来自用户 {sender_id}。")
+        # 规则 2: 检查是否满足转发条件，先检查最常见的群组条件
+        # 条件 A: 来自指定群组的消息
+        if is_group and chat_id in self.forward_group_ids:
             return True
 
-        # 条件 B: 来自指定群组的消息
-        if is_group and chat_id in self.forward_group_ids:
-            logger.debug(f"转发群组消息 {message.id}，来自群组 {chat_id}。")
+        # 条件 B: 来自指定用户的私聊消息 (非自己发送的)
+        if is_incoming_private and sender_id in self.forward_user_ids:
             return True
 
         # 如果以上条件都不满足
-        logger.debug(
-            f"不转发消息 {message.id}：不满足转发规则 (Sender: {sender_id}, Chat: {chat_id}, PrivateIn: {is_incoming_private}, Group: {is_group})。"
-        )
         return False
 
     def _should_log_deletion(self, event: events.MessageDeleted.Event) -> bool:
         """检查删除事件是否应记录日志。根据当前需求，始终返回 False 以禁用删除日志。"""
         # 不再记录任何删除事件
         logger.debug(
-            f"删除事件 (IDs: {event.deleted_ids}, Chat: {event.chat_id}) 被忽略，因为删除日志功能已禁用。"
+            "删除事件 (IDs: %s, Chat: %s) 被忽略，因为删除日志功能已禁用。",
+            event.deleted_ids,
+            event.chat_id,
         )
         return False
         
@@ -314,14 +529,18 @@ class OutputHandler(BaseHandler):
         # # 规则 1: 如果知道 chat_id 且在忽略列表，则忽略
         # if chat_id and chat_id in self.ignored_ids:
         #     logger.debug(
-        #         f"忽略删除事件 (IDs: {event.deleted_ids})：聊天 {chat_id} 在忽略列表中。"
+        #         "忽略删除事件 (IDs: %s)：聊天 %s 在忽略列表中。",
+        #         event.deleted_ids,
+        #         chat_id,
         #     )
         #     return False
         #
         # # 规则 2: 只记录发生在被转发群组中的删除事件
         # if chat_id and chat_id in self.forward_group_ids:
         #     logger.debug(
-        #         f"记录删除事件 (IDs: {event.deleted_ids})：发生在转发群组 {chat_id} 中。"
+        #         "记录删除事件 (IDs: %s)：发生在转发群组 %s 中。",
+        #         event.deleted_ids,
+        #         chat_id,
         #     )
         #     return True
         #
@@ -329,63 +548,84 @@ class OutputHandler(BaseHandler):
         # # 速率限制将防止未知来源的删除事件刷屏
         # if chat_id is None:
         #     logger.debug(
-        #         f"记录删除事件 (IDs: {event.deleted_ids})：chat_id 未知，默认记录。"
+        #         "记录删除事件 (IDs: %s)：chat_id 未知，默认记录。", event.deleted_ids
         #     )
         #     return True
         #
         # # 如果 chat_id 已知但不在转发群组列表中
         # logger.debug(
-        #     f"不记录删除事件 (IDs: {event.deleted_ids})：聊天 {chat_id} 不在转发群组列表中。"
+        #     "不记录删除事件 (IDs: %s)：聊天 %s 不在转发群组列表中。",
+        #     event.deleted_ids,
+        #     chat_id,
         # )
         # return False
 
     # --- 数据库交互 ---
 
     async def _get_message_from_db_with_retry(
-        self, message_id: int, chat_id: Optional[int] = None
+        self,
+        message_id: int,
+        chat_id: Optional[int] = None,
+        skip_initial_lookup: bool = False,
     ) -> Optional[Message]:
         """
         从数据库检索消息，包含短暂重试以处理潜在的持久化延迟。
+        首次未找到时等待该消息 ID 的写入通知再重试，最多等待 retry_delay 秒。
         如果提供了 chat_id，会进行验证。
+        调用方已确认消息不在库中时 (例如批量查询未命中) 传入 skip_initial_lookup=True，
+        直接等待写入通知，省去一次重复的查询。
         """
-        retry_delay = 0.5  # 重试前的等待时间（秒）
+        retry_delay = 0.5  # 等待写入通知的最长时间（秒）
         message = None
         try:
             # 第一次尝试
-            message = self.db.get_message_by_id(message_id)
+            if not skip_initial_lookup:
+                message = await self.db.get_message_by_id_async(message_id)
             if message and (chat_id is None or message.chat_id == chat_id):
                 return message
             elif message:  # 找到了但 chat_id 不匹配
                 logger.warning(
-                    f"数据库中找到消息 {message_id}，但其 chat_id ({message.chat_id}) 与事件 ({chat_id}) 不匹配。"
+                    "数据库中找到消息 %s，但其 chat_id (%s) 与事件 (%s) 不匹配。",
+                    message_id,
+                    message.chat_id,
+                    chat_id,
                 )
                 return None  # 视为未找到
 
-            # 如果第一次未找到，等待后重试
+            # 如果第一次未找到，等待这条消息落库的通知 (或超时) 后再查询一次
             logger.debug(
-                f"消息 {message_id} 在数据库中首次未找到，将在 {retry_delay} 秒后重试。"
+                "消息 %s 在数据库中首次未找到，将在 %s 秒内等待写入后重试。",
+                message_id,
+                retry_delay,
             )
-            await asyncio.sleep(retry_delay)
-            message = self.db.get_message_by_id(message_id)
+            await self.db.wait_for_message(message_id, timeout=retry_delay)
+            message = await self.db.get_message_by_id_async(message_id)
 
             if message and (chat_id is None or message.chat_id == chat_id):
-                logger.info(f"消息 {message_id} 在重试后于数据库中找到。")
+                logger.info("消息 %s 在重试后于数据库中找到。", message_id)
                 return message
             elif message:  # 重试后找到但 chat_id 不匹配
                 logger.warning(
-                    f"数据库中重试找到消息 {message_id}，但其 chat_id ({message.chat_id}) 与事件 ({chat_id}) 不匹配。"
+                    "数据库中重试找到消息 %s，但其 chat_id (%s) 与事件 (%s) 不匹配。",
+                    message_id,
+                    message.chat_id,
+                    chat_id,
                 )
                 return None  # 视为未找到
             else:
                 # 注意：这里改为 warning，因为消息可能确实不存在或已被清理
                 logger.warning(
-                    f"消息 {message_id} 在重试后仍未在数据库中找到或 chat_id 不匹配。"
+                    "消息 %s 在重试后仍未在数据库中找到或 chat_id 不匹配。",
+                    message_id,
                 )
                 return None
 
         except Exception as e:
             logger.error(
-                f"从数据库检索消息 {message_id} 时发生错误: {e}", exc_info=True
+                "从数据库检索消息 %s 时发生错误: %s",
+                message_id,
+                e,
+                exc_info=True,
             )
             return None
 
@@ -396,49 +636,70 @@ class OutputHandler(BaseHandler):
         检查并应用删除事件的速率限制。
         返回 True 表示事件应继续处理，False 表示被限制。
         """
-        now = datetime.now(timezone.utc)
+        now = time.monotonic()
+        paused_until = self._rate_limit_paused_until
 
         # 检查是否处于暂停状态
-        if self._rate_limit_paused_until and now < self._rate_limit_paused_until:
-            # 仍在暂停期内，限制事件
-            logger.warning(
-                f"删除日志记录因速率限制而暂停中，直到 {self._rate_limit_paused_until}"
-            )
-            return False
-
-        # 如果暂停时间已过，重置暂停状态
-        if self._rate_limit_paused_until and now >= self._rate_limit_paused_until:
+        if paused_until is not None:
+            if now < paused_until:
+                # 仍在暂停期内，限制事件
+                logger.warning(
+                    "删除日志记录因速率限制而暂停中，剩余 %.1f 秒", paused_until - now
+                )
+                return False
+            # 暂停时间已过，重置暂停状态
             logger.info("删除日志记录的速率限制暂停已结束。")
             self._rate_limit_paused_until = None
+            self._pause_notified = False
+
+        window_s = self._deletion_rate_limit_window_s
+        if window_s <= 0:
+            # 窗口长度为 0 (或负数) 时窗口内只有当前这一次事件，与原先按时间戳清理的行为一致
+            estimated_count = 1
+        else:
+            # 滚动窗口：跨过一个窗口时当前计数转为上一窗口计数，跨过多个窗口时全部清零
+            if self._deletion_window_start is None:
+                self._deletion_window_start = now
+            elapsed_windows = int((now - self._deletion_window_start) // window_s)
+            if elapsed_windows > 0:
+                self._deletion_prev_count = (
+                    self._deletion_curr_count if elapsed_windows == 1 else 0
+                )
+                self._deletion_curr_count = 0
+                self._deletion_window_start += elapsed_windows * window_s
 
-        # 清理时间窗口之外的旧时间戳
-        cutoff = now - self.deletion_rate_limit_window
-        while self._deletion_timestamps and self._deletion_timestamps[0] <= cutoff:
-            self._deletion_timestamps.popleft()
+            # 记录当前事件 (将整个 MessageDeletedEvent 视为一次事件)
+            self._deletion_curr_count += 1
 
-        # 记录当前事件的时间戳 (将整个 MessageDeletedEvent 视为一次事件)
-        self._deletion_timestamps.append(now)
+            # 按上一窗口在滑动窗口内的重叠比例加权，估算过去一个窗口内的事件数
+            overlap = 1.0 - (now - self._deletion_window_start) / window_s
+            estimated_count = (
+                self._deletion_prev_count * overlap + self._deletion_curr_count
+            )
 
         # 检查是否超过阈值
-        if len(self._deletion_timestamps) > self.deletion_rate_limit_threshold:
+        if estimated_count > self.deletion_rate_limit_threshold:
             # 超过阈值，设置暂停时间
-            self._rate_limit_paused_until = now + self.deletion_pause_duration
+            self._rate_limit_paused_until = now + self._deletion_pause_duration_s
+            # 仅在触发时（冷路径）构造用于展示的墙上时间
+            resume_at = datetime.now(timezone.utc) + timedelta(
+                seconds=self._deletion_pause_duration_s
+            )
             logger.warning(
-                f"删除事件速率限制触发！在过去 {self.deletion_rate_limit_window.total_seconds()} 秒内发生 "
-                f"{len(self._deletion_timestamps)} 次删除事件 (阈值: {self.deletion_rate_limit_threshold})。"
-                f"将暂停记录删除事件直到 {self._rate_limit_paused_until}。"
+                "删除事件速率限制触发！在过去 %s 秒内发生约 %.1f 次删除事件 (阈值: %s)。"
+                "将暂停记录删除事件直到 %s。",
+                self._deletion_rate_limit_window_s,
+                estimated_count,
+                self.deletion_rate_limit_threshold,
+                resume_at,
             )
-            # 发送一次性的暂停通知到日志频道
+            # 发送一次性的暂停通知到日志频道，放到后台任务中，不阻塞当前事件
             if self.log_sender:
-                try:
-                    await self.log_sender.send_message(
-                        f"⚠️ **删除消息速率过快**\n"
-                        f"检测到大量删除事件 (超过 {self.deletion_rate_limit_threshold} 条 / {self.deletion_rate_limit_window.total_seconds()} 秒)。\n"
-                        f"将暂停记录删除事件 {self.deletion_pause_duration.total_seconds()} 秒以避免刷屏。",
-                        parse_mode="markdown",
-                    )
-                except Exception as send_error:
-                    logger.error(f"发送速率限制暂停通知失败: {send_error}")
+                if not self._pause_notified:
+                    self._pause_notified = True
+                    task = asyncio.create_task(self._send_pause_notice())
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
             else:
                 logger.error("LogSender 未初始化，无法发送速率限制暂停通知。")
 
@@ -447,8 +708,126 @@ class OutputHandler(BaseHandler):
         # 未达到阈值，允许事件
         return True
 
+    async def _send_pause_notice(self):
+        """向日志频道发送删除事件速率限制的暂停通知。"""
+        try:
+            await self.log_sender.send_message(
+                f"⚠️ **删除消息速率过快**\n"
+                f"检测到大量删除事件 (超过 {self.deletion_rate_limit_threshold} 条 / {self._deletion_rate_limit_window_s} 秒)。\n"
+                f"将暂停记录删除事件 {self._deletion_pause_duration_s} 秒以避免刷屏。",
+                parse_mode="markdown",
+            )
+        except Exception as send_error:
+            logger.error("发送速率限制暂停通知失败: %s", send_error)
+
+    # --- 文本日志合并发送 ---
+
+    async def _enqueue_log(self, text: str):
+        """
+        将 Markdown 文本日志加入合并缓冲区，加入后会超出长度上限时先发送已缓冲的内容。
+        每条日志单独解析，某条日志中不成对的标记不会影响同一批中的其它日志。
+        """
+        plain, entities = markdown.parse(text)
+        units = _utf16_len(plain)
+        async with self._pending_lock:
+            added = units + (_LOG_BATCH_SEPARATOR_UNITS if self._pending_texts else 0)
+            if self._pending_texts and self._pending_units + added > _LOG_BATCH_MAX_UNITS:
+                await self._flush_locked()
+                added = units
+            self._pending_texts.append((plain, entities))
+            self._pending_units += added
+
+    async def _flush(self):
+        """立即发送缓冲区中的所有文本日志。"""
+        async with self._pending_lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self):
+        """合并并发送缓冲区中的文本日志，调用方需持有 _pending_lock。"""
+        if not self._pending_texts:
+            return
+        texts = self._pending_texts
+        self._pending_texts = []
+        self._pending_units = 0
+        if not self.log_sender:
+            logger.error("LogSender 未初始化，丢弃 %s 条缓冲的文本日志。", len(texts))
+            return
+
+        # 拼接纯文本，并按累计的 UTF-16 偏移平移每条日志自己的实体
+        parts: List[str] = []
+        entities: List[TypeMessageEntity] = []
+        offset = 0
+        for plain, plain_entities in texts:
+            if parts:
+                parts.append(_LOG_BATCH_SEPARATOR)
+                offset += _LOG_BATCH_SEPARATOR_UNITS
+            for entity in plain_entities:
+                entity.offset += offset
+                entities.append(entity)
+            parts.append(plain)
+            offset += _utf16_len(plain)
+        await self.log_sender.send_message(
+            "".join(parts), formatting_entities=entities
+        )
+
+    async def _flusher(self):
+        """
+        后台任务：按 log_batch_flush_interval 定期发送缓冲的文本日志。
+        文本日志因此最多延迟一个间隔才发出；进程被强制终止时，尚在缓冲区中的日志会丢失。
+        """
+        while True:
+            await asyncio.sleep(self.log_batch_flush_interval)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error("定期发送缓冲的文本日志失败: %s", e, exc_info=True)
+
+    async def shutdown(self):
+        """等待仍在发送的媒体消息完成，发出缓冲的文本日志并停止后台任务。"""
+        if self._inflight:
+            logger.info("等待 %s 条媒体消息发送完成...", len(self._inflight))
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        # 持有锁再取消定时任务：若它正在发送，先等这一批发完，避免已取出的日志随取消丢失
+        async with self._pending_lock:
+            if self._flusher_task is not None:
+                self._flusher_task.cancel()
+                self._flusher_task = None
+            try:
+                await self._flush_locked()
+            except Exception as e:
+                logger.error("关闭时发送缓冲的文本日志失败: %s", e, exc_info=True)
+
     # --- 格式化与发送 ---
 
+    async def _create_mention_cached(self, entity_id: int, msg_id: Optional[int] = None) -> str:
+        """与 create_mention 相同，但按 entity_id 缓存解析出的实体，链接部分每次在本地拼接。"""
+        if entity_id == 0:
+            # ID 为 0 代表自己，交给 create_mention 的专门处理
+            return await create_mention(self.client, entity_id, msg_id)
+
+        now = time.monotonic()
+        cached = self._entity_cache.get(entity_id)
+        if cached is not None and cached[0] > now:
+            entity = cached[1]
+        else:
+            try:
+                entity = await self.client.get_entity(entity_id)
+            except Exception as e:
+                logger.error("为 ID %s 创建提及失败: %s", entity_id, e, exc_info=True)
+                return str(entity_id)  # 返回原始 ID
+            if entity_id not in self._entity_cache and len(self._entity_cache) >= _ENTITY_CACHE_MAXSIZE:
+                # 淘汰最早加入的条目
+                self._entity_cache.pop(next(iter(self._entity_cache)))
+            self._entity_cache[entity_id] = (now + _ENTITY_CACHE_TTL, entity)
+        return format_entity_mention(entity, entity_id, msg_id)
+
+    # 事件类型 -> 日志标题
+    _EVENT_TITLES = {
+        "新消息": "✉️ **新消息**",
+        "编辑消息": "✏️ **编辑消息**",
+        "删除消息": "🗑️ **删除消息**",
+    }
+
     async def _format_output_message(
         self,
         event_type: str,  # "新消息", "编辑消息", "删除消息"
@@ -461,138 +840,127 @@ class OutputHandler(BaseHandler):
             logger.error("Client 未设置，无法格式化消息。")
             return "❌ 格式化错误：客户端未设置。"
 
-        sender_mention = "未知用户"
-        chat_mention = ""
-        text_content = ""
-        msg_id = 0
-        date_str = "未知时间"
-        edit_date_str = ""
-        reply_to_str = ""
-        chat_id_for_link = None  # 用于构造回复链接
-
         try:
-            if isinstance(message_data, TelethonMessage):
-                # 处理来自事件的实时 Telethon Message 对象
-                msg_id = message_data.id
-                chat_id = message_data.chat_id
-                chat_id_for_link = chat_id  # 保存 chat_id 用于链接
-                sender_id = self._get_sender_id(message_data)
-                text_content = message_data.text or ""
-                date = message_data.date
-                edit_date = getattr(message_data, "edit_date", None)
-                reply_to_msg_id = message_data.reply_to_msg_id
-
-                # 异步获取提及信息
-                sender_mention = await create_mention(self.client, sender_id, msg_id)
-                if chat_id and not message_data.is_private:
-                    chat_mention = await create_mention(
-                        self.client, chat_id, msg_id
-                    )  # 使用 msg_id 尝试生成链接
-
-            elif isinstance(message_data, Message):
-                # 处理从数据库检索的 Message 数据对象
-                msg_id = message_data.id
-                chat_id = message_data.chat_id
-                chat_id_for_link = chat_id  # 保存 chat_id 用于链接
-                sender_id = message_data.from_id
-                text_content = message_data.msg_text  # 使用 msg_text
-                date = message_data.created_time  # 使用 created_time
-                edit_date = message_data.edited_time  # 使用 edited_time
-                reply_to_msg_id = None  # Message 对象中没有此信息
-
-                # 异步获取提及信息
-                sender_mention = await create_mention(self.client, sender_id, msg_id)
-                # 检查 chat_id 是否存在且不等于 sender_id (基本判断是否为非私聊群组/频道)
-                if chat_id and chat_id != sender_id:
-                    chat_mention = await create_mention(self.client, chat_id, msg_id)
-
-            else:
-                logger.error(f"无法格式化消息：无效的数据类型 {type(message_data)}")
-                return f"❌ 格式化错误：无效的消息数据类型 {type(message_data)}"
-
-            # 格式化日期和回复信息
-            date_str = (
-                date.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-                if date
-                else "未知时间"
-            )
-            if edit_date and not is_deleted:
-                edit_date_str = f"\n**编辑于:** {edit_date.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}"
-            if reply_to_msg_id:
-                # 尝试为回复的消息创建链接 (如果 chat_id 已知)
-                reply_link = ""
-                if chat_id_for_link:
-                    try:
-                        # 简单的链接构造，适用于超级群组/频道
-                        link_chat_id_str = str(abs(chat_id_for_link))
-                        if link_chat_id_str.startswith("100"):
-                            link_chat_id_str = link_chat_id_str[3:]  # 移除 -100 前缀
-                        # 对于普通群组，链接格式不同，这里简化处理，可能不总正确
-                        if not str(chat_id_for_link).startswith("-100"):
-                            # 普通群组链接通常不直接可用，这里仅显示 ID
-                            reply_link = f" (回复普通群组消息 ID: {reply_to_msg_id})"  # 提供一些信息
-                        else:
-                            reply_link = f" [回复消息](https://t.me/c/{link_chat_id_str}/{reply_to_msg_id})"
-                        # *** 将创建的链接或回退文本赋值给 reply_to_str ***
-                        reply_to_str = reply_link
-                    except Exception as link_err:
-                        logger.warning(
-                            f"为回复消息 {reply_to_msg_id} (Chat: {chat_id_for_link}) 创建链接失败: {link_err}"
-                        )
-                        # 链接构造失败时的回退
-                        reply_to_str = f" (回复消息 ID: {reply_to_msg_id})"
-                        pass  # 链接构造失败就算了
-                else:
-                    # 如果 chat_id 未知，仅显示回复的 ID
-                    reply_to_str = f" (回复消息 ID: {reply_to_msg_id})"
-
-            # 截断过长的消息文本
-            if len(text_content) > 3500:  # Telegram 消息长度限制约为 4096，留些余地
-                text_content = text_content[:3500] + "... (消息过长截断)"
-
-            # 构建最终的格式化字符串
-            header = ""
-            if event_type == "新消息":
-                header = f"✉️ **新消息** {chat_mention}\n**来自:** {sender_mention}"
-            elif event_type == "编辑消息":
-                header = f"✏️ **编辑消息** {chat_mention}\n**来自:** {sender_mention}"
-            elif event_type == "删除消息":
-                header = f"🗑️ **删除消息** {chat_mention}\n**来自:** {sender_mention}"
-
-            # 添加媒体指示器（如果适用）
-            media_indicator = ""
-            if isinstance(message_data, TelethonMessage) and message_data.media:
-                media_type = type(message_data.media).__name__
-                # 尝试获取文件名
-                filename = ""
-                if hasattr(message_data.media, "attributes"):
-                    for attr in message_data.media.attributes:
-                        if isinstance(attr, DocumentAttributeFilename):
-                            filename = f" ({attr.file_name})"
-                            break
-                media_indicator = f"\n**媒体:** {media_type}{filename}"
-            elif isinstance(message_data, Message) and message_data.media_path:
-                # 数据库中只存了路径，没有类型名或文件名
-                media_indicator = "\n**媒体:** [文件]"  # 仅指示存在媒体文件
-
-            footer = f"\n**消息 ID:** `{msg_id}`{reply_to_str}\n**时间:** {date_str}{edit_date_str}{media_indicator}"
-
-            # 移除可能存在的 Markdown 格式冲突字符，例如在 text_content 中
-            # 简单的清理，可能需要更复杂的处理
-            text_content = (
-                text_content.replace("*", "\\*").replace("_", "\\_").replace("`", "\\`")
+            # 先完成纯字符串部分，格式化失败时不会白白发起提及查询
+            try:
+                title, body = self._format_header_footer_sync(
+                    event_type, message_data, is_deleted
+                )
+            except _UnsupportedMessageData as e:
+                logger.error("无法格式化消息：%s", e)
+                return f"❌ 格式化错误：{e}"
+            sender_mention, chat_mention = await self._resolve_mentions_async(message_data)
+            header = (
+                f"{title} {chat_mention}\n**来自:** {sender_mention}" if title else ""
             )
-
-            return f"{header}\n\n{text_content}\n{footer}"
+            return f"{header}\n\n{body}"
 
         except Exception as e:
             # 尝试获取 msg_id 用于日志
             error_msg_id = getattr(message_data, "id", "未知")
             logger.error(
-                f"格式化消息 (ID: {error_msg_id}) 时发生错误: {e}", exc_info=True
+                "格式化消息 (ID: %s) 时发生错误: %s",
+                error_msg_id,
+                e,
+                exc_info=True,
             )
             return f"❌ 格式化消息时出错 (ID: {error_msg_id})。"
 
+    def _format_header_footer_sync(
+        self,
+        event_type: str,
+        message_data: Union[TelethonMessage, Message],
+        is_deleted: bool = False,
+    ) -> Tuple[str, str]:
+        """
+        完成不需要网络请求的格式化工作，返回 (标题, 正文与页脚)。
+        数据类型无效时抛出 _UnsupportedMessageData。
+        """
+        edit_date_str = ""
+        reply_to_str = ""
+
+        if isinstance(message_data, TelethonMessage):
+            # 处理来自事件的实时 Telethon Message 对象
+            msg_id = message_data.id
+            chat_id_for_link = message_data.chat_id  # 用于构造回复链接
+            text_content = message_data.text or ""
+            date = message_data.date
+            edit_date = getattr(message_data, "edit_date", None)
+            reply_to_msg_id = message_data.reply_to_msg_id
+        elif isinstance(message_data, Message):
+            # 处理从数据库检索的 Message 数据对象
+            msg_id = message_data.id
+            chat_id_for_link = message_data.chat_id
+            text_content = message_data.msg_text  # 使用 msg_text
+            date = message_data.created_time  # 使用 created_time
+            edit_date = message_data.edited_time  # 使用 edited_time
+            reply_to_msg_id = None  # Message 对象中没有此信息
+        else:
+            raise _UnsupportedMessageData(f"无效的消息数据类型 {type(message_data)}")
+
+        # 格式化日期和回复信息
+        date_str = _fmt_utc(date) if date else "未知时间"
+        if edit_date and not is_deleted:
+            edit_date_str = f"\n**编辑于:** {_fmt_utc(edit_date)}"
+        if reply_to_msg_id:
+            # 尝试为回复的消息创建链接 (如果 chat_id 已知)
+            if chat_id_for_link:
+                prefix = _chat_link_prefix(chat_id_for_link)
+                if prefix:
+                    reply_to_str = f" [回复消息]({prefix}/{reply_to_msg_id})"
+                else:
+                    # 普通群组链接通常不直接可用，这里仅显示 ID
+                    reply_to_str = f" (回复普通群组消息 ID: {reply_to_msg_id})"
+            else:
+                # 如果 chat_id 未知，仅显示回复的 ID
+                reply_to_str = f" (回复消息 ID: {reply_to_msg_id})"
+
+        # 截断过长的消息文本
+        if len(text_content) > 3500:  # Telegram 消息长度限制约为 4096，留些余地
+            text_content = text_content[:3500] + "... (消息过长截断)"
+
+        # 添加媒体指示器（如果适用）
+        media_indicator = ""
+        if isinstance(message_data, TelethonMessage) and message_data.media:
+            media_type = type(message_data.media).__name__
+            # 尝试获取文件名
+            _, file_name = _scan_media_attributes(message_data.media)
+            filename = f" ({file_name})" if file_name else ""
+            media_indicator = f"\n**媒体:** {media_type}{filename}"
+        elif isinstance(message_data, Message) and message_data.media_path:
+            # 数据库中只存了路径，没有类型名或文件名
+            media_indicator = "\n**媒体:** [文件]"  # 仅指示存在媒体文件
+
+        footer = f"\n**消息 ID:** `{msg_id}`{reply_to_str}\n**时间:** {date_str}{edit_date_str}{media_indicator}"
+
+        # 移除可能存在的 Markdown 格式冲突字符，例如在 text_content 中
+        # 简单的清理，可能需要更复杂的处理
+        # 截断已在前面完成，这里只扫描有限长度的文本
+        text_content = text_content.translate(_MD_ESCAPE)
+
+        return self._EVENT_TITLES.get(event_type, ""), f"{text_content}\n{footer}"
+
+    async def _resolve_mentions_async(
+        self, message_data: Union[TelethonMessage, Message]
+    ) -> Tuple[str, str]:
+        """获取发送者与聊天的提及文本，返回 (sender_mention, chat_mention)。"""
+        chat_mention = ""
+        msg_id = message_data.id
+        chat_id = message_data.chat_id
+        if isinstance(message_data, TelethonMessage):
+            sender_id = self._get_sender_id(message_data)
+            show_chat = chat_id and not message_data.is_private
+        else:
+            sender_id = message_data.from_id
+            # 检查 chat_id 是否存在且不等于 sender_id (基本判断是否为非私聊群组/频道)
+            show_chat = chat_id and chat_id != sender_id
+
+        sender_mention = await self._create_mention_cached(sender_id, msg_id)
+        if show_chat:
+            # 使用 msg_id 尝试生成链接
+            chat_mention = await self._create_mention_cached(chat_id, msg_id)
+        return sender_mention, chat_mention
+
     async def _send_message_with_media(self, text: str, message: TelethonMessage):
         """处理带媒体的消息发送，优先使用持久化数据，按需下载作为后备。"""
         if not self.log_sender or not self.restricted_media_handler or not self.client:
@@ -604,8 +972,6 @@ class OutputHandler(BaseHandler):
                 )
             return
 
-        media_file_to_send = None # 用于持有最终要发送的文件句柄或路径
-        media_context = None # 用于管理需要退出的上下文
         send_method = "log_sender" # 默认使用 log_sender 发送 (带文件)
         caption_to_use = text # 默认使用完整格式化文本作为标题
         reply_to_use = message.reply_to_msg_id # 保留回复
@@ -613,15 +979,15 @@ class OutputHandler(BaseHandler):
         try:
             if not message.media:
                 # 没有媒体，直接发送文本
-                logger.debug(f"消息 {message.id} 无媒体，仅发送文本。")
-                await self.log_sender.send_message(text, parse_mode="markdown")
+                logger.debug("消息 %s 无媒体，仅发送文本。", message.id)
+                await self._enqueue_log(text)
                 return
 
+            # 带媒体的消息单独发送，先发出已缓冲的文本日志以保持顺序
+            await self._flush()
+
             # --- 改进的识别逻辑 ---
-            is_sticker = any(
-                isinstance(attr, DocumentAttributeSticker)
-                for attr in getattr(message.media, "attributes", [])
-            )
+            is_sticker, _ = _scan_media_attributes(message.media)
 
             # 1. 检查消息本身的 noforwards 标志
             message_restricted = getattr(message, "noforwards", False)
@@ -634,55 +1000,52 @@ class OutputHandler(BaseHandler):
                 # 在某些情况下（例如来自匿名管理员的消息），get_chat 可能返回 None
                 chat = await message.get_chat()
                 if chat and getattr(chat, 'noforwards', False): # 检查聊天本身的 noforwards 属性
-                    logger.debug(f"消息 {message.id} 所在的聊天 {getattr(chat, 'id', '未知')} 设置了 noforwards 限制。")
+                    logger.debug("消息 %s 所在的聊天 %s 设置了 noforwards 限制。", message.id, getattr(chat, 'id', '未知'))
                     chat_restricted = True
 
             except AttributeError as ae:
                  # 处理 message.get_chat() 可能不存在的情况 (虽然不太可能)
-                 logger.warning(f"无法调用 message.get_chat() 获取消息 {message.id} 的聊天信息: {ae}")
+                 logger.warning("无法调用 message.get_chat() 获取消息 %s 的聊天信息: %s", message.id, ae)
             except telethon.errors.rpcerrorlist.ChannelPrivateError:
                  # Bot 不在该频道/群组，无法获取信息，视为受限
-                 logger.warning(f"无法获取消息 {message.id} 的聊天信息 (ChannelPrivateError)，假定聊天受限。")
+                 logger.warning("无法获取消息 %s 的聊天信息 (ChannelPrivateError)，假定聊天受限。", message.id)
                  chat_restricted = True
             except Exception as chat_err:
                 # 获取聊天信息时发生其他错误，记录警告，但默认不视为受限（避免误判）
                 # 下载时仍然会因权限失败
-                logger.warning(f"获取消息 {message.id} 的聊天信息以检查限制时发生未知错误: {chat_err}")
+                logger.warning("获取消息 %s 的聊天信息以检查限制时发生未知错误: %s", message.id, chat_err)
                 # chat_restricted = False # 保持 False
 
             # 最终判断：消息本身或其所在聊天受限，都视为受限媒体
             is_restricted = message_restricted or chat_restricted
 
-            logger.debug(f"消息 {message.id}: message_restricted={message_restricted}, chat_restricted={chat_restricted}, final is_restricted={is_restricted}")
+            logger.debug("消息 %s: message_restricted=%s, chat_restricted=%s, final is_restricted=%s", message.id, message_restricted, chat_restricted, is_restricted)
 
             # --- 尝试从数据库获取持久化信息 (仅对贴纸和受限媒体) ---
             db_message: Optional[Message] = None
             media_path_from_db: Optional[str] = None
             if is_sticker or is_restricted:
-                logger.debug(f"尝试从数据库获取消息 {message.id} 的媒体路径...")
+                logger.debug("尝试从数据库获取消息 %s 的媒体路径...", message.id)
                 # 使用带重试的方法获取数据库记录
                 db_message = await self._get_message_from_db_with_retry(message.id, message.chat_id)
                 if db_message and db_message.media_path:
                     media_path_from_db = db_message.media_path
-                    logger.info(f"成功从数据库获取到消息 {message.id} 的媒体路径: {media_path_from_db}")
+                    logger.info("成功从数据库获取到消息 %s 的媒体路径: %s", message.id, media_path_from_db)
                 else:
-                    logger.warning(f"未能从数据库获取到消息 {message.id} 的媒体路径 (或记录不存在)。将尝试后备下载。")
+                    logger.warning("未能从数据库获取到消息 %s 的媒体路径 (或记录不存在)。将尝试后备下载。", message.id)
 
             # --- 处理流程 ---
 
             # 1. 处理贴纸
             if is_sticker:
-                logger.debug(f"消息 {message.id} 是贴纸。")
+                logger.debug("消息 %s 是贴纸。", message.id)
                 send_method = "client" # 贴纸通常用 client.send_file
                 try:
                     if media_path_from_db:
                         # 优先使用数据库路径 (贴纸通常未加密)
-                        logger.debug(f"尝试使用数据库路径 {media_path_from_db} 发送贴纸 {message.id}")
-                        # retrieve_media_as_file 返回同步上下文
-                        # 需要从 utils.media 导入 retrieve_media_as_file
-                        from ..utils.media import retrieve_media_as_file
-                        media_context = retrieve_media_as_file(media_path_from_db, is_restricted=False)
-                        async with self.manage_sync_context(media_context) as media_file_to_send:
+                        logger.debug("尝试使用数据库路径 %s 发送贴纸 %s", media_path_from_db, message.id)
+                        # retrieve_media_as_file 是同步上下文管理器，直接用 with 保证退出
+                        with retrieve_media_as_file(media_path_from_db, is_restricted=False) as media_file_to_send:
                              if media_file_to_send:
                                  await self.client.send_file(
                                      self.log_chat_id,
@@ -691,17 +1054,16 @@ class OutputHandler(BaseHandler):
                                      parse_mode="markdown",
                                      reply_to=reply_to_use,
                                  )
-                                 logger.info(f"贴纸消息 {message.id} (来自DB) 已发送。")
+                                 logger.info("贴纸消息 %s (来自DB) 已发送。", message.id)
                                  return # 发送成功
                              else:
-                                 logger.error(f"未能从数据库路径 {media_path_from_db} 准备好贴纸 {message.id}。")
+                                 logger.error("未能从数据库路径 %s 准备好贴纸 %s。", media_path_from_db, message.id)
                                  # 继续尝试后备下载
                     else:
-                         logger.info(f"数据库路径未找到或无效，执行贴纸 {message.id} 的后备临时下载。")
+                         logger.info("数据库路径未找到或无效，执行贴纸 %s 的后备临时下载。", message.id)
 
                     # 后备：临时下载
-                    media_context = self.restricted_media_handler.download_and_yield_temporary(message)
-                    async with media_context as media_file_to_send:
+                    async with self.restricted_media_handler.download_and_yield_temporary(message) as media_file_to_send:
                         if media_file_to_send:
                             await self.client.send_file(
                                 self.log_chat_id,
@@ -710,85 +1072,82 @@ class OutputHandler(BaseHandler):
                                 parse_mode="markdown",
                                 reply_to=reply_to_use,
                             )
-                            logger.info(f"贴纸消息 {message.id} (临时下载) 已发送。")
+                            logger.info("贴纸消息 %s (临时下载) 已发送。", message.id)
                             return # 发送成功
                         else:
-                             logger.error(f"未能通过临时下载准备好贴纸 {message.id}。")
+                             logger.error("未能通过临时下载准备好贴纸 %s。", message.id)
 
                 except Exception as sticker_err:
-                    logger.error(f"发送贴纸 {message.id} 时出错: {sticker_err}", exc_info=True)
+                    logger.error("发送贴纸 %s 时出错: %s", message.id, sticker_err, exc_info=True)
                 # 如果贴纸发送失败，降级到下面发送纯文本
 
             # 2. 处理受限媒体 (非贴纸)
             elif is_restricted:
-                logger.debug(f"消息 {message.id} 包含受限媒体。")
+                logger.debug("消息 %s 包含受限媒体。", message.id)
                 send_method = "log_sender" # 受限媒体解密后用 log_sender 发送
 
                 # --- 新增：检查是否为小型受限媒体，直接内存/临时文件下载 ---
                 if message.media and message.file and message.file.size is not None and message.file.size <= MAX_IN_MEMORY_FILE_SIZE:
-                    logger.info(f"受限媒体 {message.id} 小于阈值 ({message.file.size} <= {MAX_IN_MEMORY_FILE_SIZE})，尝试直接临时下载。")
+                    logger.info("受限媒体 %s 小于阈值 (%s <= %s)，尝试直接临时下载。", message.id, message.file.size, MAX_IN_MEMORY_FILE_SIZE)
                     try:
-                        media_context = self.restricted_media_handler.download_and_yield_temporary(message)
-                        async with media_context as media_file_to_send:
+                        async with self.restricted_media_handler.download_and_yield_temporary(message) as media_file_to_send:
                             if media_file_to_send:
                                 await self.log_sender.send_message(
                                     caption_to_use,
                                     file=media_file_to_send, # 发送文件句柄
                                     parse_mode="markdown"
                                 )
-                                logger.info(f"小型受限媒体消息 {message.id} (直接临时下载) 已处理并发送。")
+                                logger.info("小型受限媒体消息 %s (直接临时下载) 已处理并发送。", message.id)
                                 return # 发送成功
                             else:
-                                logger.error(f"未能通过直接临时下载准备好小型受限媒体 {message.id}。")
+                                logger.error("未能通过直接临时下载准备好小型受限媒体 %s。", message.id)
                                 # 如果准备失败，将落到下面的文本回退逻辑
                     except Exception as direct_download_err:
-                        logger.error(f"直接临时下载小型受限媒体 {message.id} 时出错: {direct_download_err}", exc_info=True)
+                        logger.error("直接临时下载小型受限媒体 %s 时出错: %s", message.id, direct_download_err, exc_info=True)
                         # 如果下载或发送出错，将落到下面的文本回退逻辑
 
                 # --- 如果文件较大或大小未知，执行原有逻辑 (DB优先，然后后备下载) ---
                 else:
-                    logger.debug(f"受限媒体 {message.id} 较大或大小未知 ({message.file.size if message.file else '未知'} > {MAX_IN_MEMORY_FILE_SIZE})，使用标准处理流程 (DB优先)。")
+                    logger.debug("受限媒体 %s 较大或大小未知 (%s > %s)，使用标准处理流程 (DB优先)。", message.id, message.file.size if message.file else '未知', MAX_IN_MEMORY_FILE_SIZE)
                     try:
                         if media_path_from_db:
                             # 优先使用数据库路径解密
-                            logger.debug(f"尝试使用数据库路径 {media_path_from_db} 处理大型受限媒体 {message.id}")
-                            media_context = self.restricted_media_handler.prepare_media_from_path(media_path_from_db)
-                            async with media_context as media_file_to_send:
+                            logger.debug("尝试使用数据库路径 %s 处理大型受限媒体 %s", media_path_from_db, message.id)
+                            async with self.restricted_media_handler.prepare_media_from_path(media_path_from_db) as media_file_to_send:
                                 if media_file_to_send:
                                     await self.log_sender.send_message(
                                         caption_to_use,
                                         file=media_file_to_send, # 发送文件句柄
                                         parse_mode="markdown"
                                     )
-                                    logger.info(f"大型受限媒体消息 {message.id} (来自DB) 已处理并发送。")
+                                    logger.info("大型受限媒体消息 %s (来自DB) 已处理并发送。", message.id)
                                     return # 发送成功
                                 else:
-                                    logger.error(f"未能从数据库路径 {media_path_from_db} 准备好大型受限媒体 {message.id}。")
+                                    logger.error("未能从数据库路径 %s 准备好大型受限媒体 %s。", media_path_from_db, message.id)
                                     # 继续尝试后备下载
                         else:
-                             logger.info(f"数据库路径未找到或无效，执行大型受限媒体 {message.id} 的后备临时下载。")
+                             logger.info("数据库路径未找到或无效，执行大型受限媒体 %s 的后备临时下载。", message.id)
 
                         # 后备：临时下载 (仅当DB路径无效或失败时，针对大型文件)
-                        media_context = self.restricted_media_handler.download_and_yield_temporary(message)
-                        async with media_context as media_file_to_send:
+                        async with self.restricted_media_handler.download_and_yield_temporary(message) as media_file_to_send:
                             if media_file_to_send:
                                 await self.log_sender.send_message(
                                     caption_to_use,
                                     file=media_file_to_send, # 发送文件句柄
                                     parse_mode="markdown"
                                 )
-                                logger.info(f"大型受限媒体消息 {message.id} (后备临时下载) 已处理并发送。")
+                                logger.info("大型受限媒体消息 %s (后备临时下载) 已处理并发送。", message.id)
                                 return # 发送成功
                             else:
-                                logger.error(f"未能通过后备临时下载准备好大型受限媒体 {message.id}。")
+                                logger.error("未能通过后备临时下载准备好大型受限媒体 %s。", message.id)
 
                     except Exception as restricted_err:
-                        logger.error(f"处理大型受限媒体 {message.id} 时出错: {restricted_err}", exc_info=True)
+                        logger.error("处理大型受限媒体 %s 时出错: %s", message.id, restricted_err, exc_info=True)
                 # 如果处理失败，降级到下面发送纯文本
 
             # 3. 处理普通媒体 (非贴纸，非受限)
             else:
-                logger.debug(f"消息 {message.id} 包含普通媒体，尝试直接发送。")
+                logger.debug("消息 %s 包含普通媒体，尝试直接发送。", message.id)
                 send_method = "client" # 普通媒体优先尝试 client.send_file
                 try:
                     # 直接使用 message.media
@@ -799,33 +1158,36 @@ class OutputHandler(BaseHandler):
                         parse_mode="markdown",
                         reply_to=reply_to_use
                     )
-                    logger.info(f"普通媒体消息 {message.id} 已直接发送。")
+                    logger.info("普通媒体消息 %s 已直接发送。", message.id)
                     return # 发送成功
 
                 # 精确捕获聊天转发限制错误，虽然理论上不应再发生，但作为保险
                 except telethon.errors.rpcerrorlist.ChatForwardsRestrictedError:
-                     logger.warning(f"直接发送普通媒体 {message.id} 失败，因为聊天禁止转发 (ChatForwardsRestrictedError)。这不应发生，因为已检查聊天限制。将回退到文本。")
+                     logger.warning("直接发送普通媒体 %s 失败，因为聊天禁止转发 (ChatForwardsRestrictedError)。这不应发生，因为已检查聊天限制。将回退到文本。", message.id)
                      # 这里也可以选择回退到 RestrictedMediaHandler 的下载逻辑，如果需要的话
                      # await self._handle_restricted_media_logic(caption_to_use, message) # 假设提取了逻辑
                 except (ChannelPrivateError, ChatAdminRequiredError, UserIsBlockedError) as permission_err:
-                     logger.warning(f"直接发送普通媒体 {message.id} 因权限问题失败: {permission_err}。将仅发送文本。")
+                     logger.warning("直接发送普通媒体 %s 因权限问题失败: %s。将仅发送文本。", message.id, permission_err)
                      # 对于权限问题，后备下载可能也无效，直接降级
                 except MessageIdInvalidError:
-                     logger.warning(f"直接发送普通媒体 {message.id} 失败，消息ID无效 (可能已被删除?)。将仅发送文本。")
+                     logger.warning("直接发送普通媒体 %s 失败，消息ID无效 (可能已被删除?)。将仅发送文本。", message.id)
                 except Exception as direct_send_err:
                     logger.error(
-                        f"直接发送普通媒体 {message.id} 失败: {direct_send_err}",
-                        exc_info=True
+                        "直接发送普通媒体 %s 失败: %s",
+                        message.id,
+                        direct_send_err,
+                        exc_info=True,
                     )
                     # 其他错误，降级
-                    logger.warning(f"直接发送普通媒体失败，将仅发送文本信息。")
+                    logger.warning("直接发送普通媒体失败，将仅发送文本信息。")
 
                 # 如果直接发送失败，降级到下面发送纯文本
                 # 注意：这里没有为普通媒体添加后备下载逻辑，以保持简单。
 
             # --- 降级处理：仅发送文本 ---
             logger.warning(
-                f"消息 {message.id} 的媒体处理失败或未处理，仅发送文本信息。"
+                "消息 %s 的媒体处理失败或未处理，仅发送文本信息。",
+                message.id,
             )
             await self.log_sender.send_message(
                 f"⚠️ **媒体可能未发送** ⚠️\n\n{text}\n\n(原始媒体未能成功处理或发送)",
@@ -834,7 +1196,10 @@ class OutputHandler(BaseHandler):
 
         except Exception as e:
             logger.critical(
-                f"发送带媒体的消息 {message.id} 时发生严重错误: {e}", exc_info=True
+                "发送带媒体的消息 %s 时发生严重错误: %s",
+                message.id,
+                e,
+                exc_info=True,
             )
             # 尝试发送最终的回退消息
             if self.log_sender:
@@ -848,19 +1213,7 @@ class OutputHandler(BaseHandler):
                     )
                 except Exception as fallback_err:
                     logger.critical(
-                        f"发送最终错误回退消息也失败 (消息 ID: {message.id}): {fallback_err}"
+                        "发送最终错误回退消息也失败 (消息 ID: %s): %s",
+                        message.id,
+                        fallback_err,
                     )
-
-    @asynccontextmanager
-    async def manage_sync_context(self, cm):
-        """辅助方法，用于在异步代码中安全地管理同步上下文管理器"""
-        resource = None
-        try:
-            resource = cm.__enter__()
-            yield resource
-        finally:
-            if 'cm' in locals():
-                try:
-                    cm.__exit__(None, None, None)
-                except Exception as exit_e:
-                    logger.error(f"Error exiting sync context manager {type(cm)}: {exit_e}")
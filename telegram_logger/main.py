@@ -264,7 +264,8 @@ async def main():
         logging.info(f"Client ID: {user_id}")  # 确认 user_id 已获取
         logging.info("Cleanup service is running")
 
-        await client_service.run()
+        # 缓冲的日志与仍在发送的媒体需要在客户端断开之前发出
+        await client_service.run(before_disconnect=output_handler.shutdown)
     except Exception as e:
         logging.critical(f"Service execution failed: {str(e)}", exc_info=True)
     except KeyboardInterrupt:
@@ -273,6 +274,9 @@ async def main():
         logging.info("Shutting down services...")
         if "cleanup_service" in locals() and cleanup_service._task:
             await cleanup_service.stop()
+        # 正常退出时 shutdown 已在断开连接前执行过；这里只为 run() 之前就出错的情况
+        # 停止后台任务，重复调用没有副作用
+        await output_handler.shutdown()
         if "db" in locals() and db.conn:
             db.close()
         logging.info("All services stopped")
@@ -1,12 +1,16 @@
+import asyncio
 import time
-from telethon import TelegramClient, events, errors as telethon_errors
+from telethon import TelegramClient, events, errors as telethon_errors, functions
 import sys # 确保 sys 已导入，因为后面用到了 sys.exit
-from typing import List
+from typing import Awaitable, Callable, List, Optional
 import logging
 from telegram_logger.handlers.base_handler import BaseHandler
 
 logger = logging.getLogger(__name__)
 
+# 断开连接前收尾工作（发送缓冲的日志等）的最长等待时间
+_BEFORE_DISCONNECT_TIMEOUT = 30.0  # 单位：秒
+
 class TelegramClientService:
     def __init__(
         self,
@@ -158,6 +162,29 @@ class TelegramClientService:
                 'last_error': str(e)
             }
 
-    async def run(self):
-        """Run client until disconnected"""
-        await self.client.run_until_disconnected()
+    async def run(
+        self, before_disconnect: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        """Run client until disconnected
+
+        与 client.run_until_disconnected() 相同，但在主动断开连接（例如收到 Ctrl+C
+        而被取消）之前先等待 before_disconnect，使其仍能通过已连接的客户端发送消息。
+        """
+        client = self.client
+        try:
+            # 通知服务器需要接收更新，然后等待断开
+            await client(functions.updates.GetStateRequest())
+            await client.disconnected
+            # 更新循环出错导致的断开，与 run_until_disconnected 一样向上抛出
+            updates_error = getattr(client, "_updates_error", None)
+            if updates_error is not None:
+                raise updates_error
+        finally:
+            if before_disconnect is not None and client.is_connected():
+                try:
+                    await asyncio.wait_for(
+                        before_disconnect(), timeout=_BEFORE_DISCONNECT_TIMEOUT
+                    )
+                except Exception as e:
+                    logger.error(f"断开连接前的收尾工作失败: {e}", exc_info=True)
+            await client.disconnect()
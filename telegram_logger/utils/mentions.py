@@ -28,18 +28,7 @@ async def create_mention(client, entity_id: int, msg_id: int = None) -> str:
     try:
         entity = await client.get_entity(entity_id)
         logger.debug(f"成功获取实体: 类型={type(entity).__name__}, ID={entity.id}")
-
-        if isinstance(entity, (Channel, Chat)):
-            mention = _format_channel_mention(entity, msg_id)
-            logger.debug(f"格式化为频道/群组提及: {mention}")
-            return mention
-        elif isinstance(entity, User):
-            mention = _format_user_mention(entity, msg_id) # msg_id 可能对用户提及无用，但保持一致性
-            logger.debug(f"格式化为用户提及: {mention}")
-            return mention
-        else:
-            logger.warning(f"获取到未知实体类型 {type(entity).__name__}，ID: {entity_id}")
-            return str(entity_id) # 返回原始 ID 作为回退
+        return format_entity_mention(entity, entity_id, msg_id)
 
     except ValueError as e:
         # Telethon 在找不到实体时可能抛出 ValueError
@@ -50,6 +39,21 @@ async def create_mention(client, entity_id: int, msg_id: int = None) -> str:
         return str(entity_id) # 返回原始 ID
 
 
+def format_entity_mention(entity, entity_id: int, msg_id: int = None) -> str:
+    """将已解析的实体格式化为提及链接，不发起任何网络请求"""
+    if isinstance(entity, (Channel, Chat)):
+        mention = _format_channel_mention(entity, msg_id)
+        logger.debug(f"格式化为频道/群组提及: {mention}")
+        return mention
+    elif isinstance(entity, User):
+        mention = _format_user_mention(entity, msg_id) # msg_id 可能对用户提及无用，但保持一致性
+        logger.debug(f"格式化为用户提及: {mention}")
+        return mention
+    else:
+        logger.warning(f"获取到未知实体类型 {type(entity).__name__}，ID: {entity_id}")
+        return str(entity_id) # 返回原始 ID 作为回退
+
+
 def _format_channel_mention(entity: Union[Channel, Chat], msg_id: int) -> str:
     """格式化频道/群组提及为 MarkdownV2 格式"""
     # 确保 entity.id 是整数，然后转换为字符串
@@ -1,269 +1,510 @@
+import asyncio
 import os
 import re
 import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple, Union
 
 # import tempfile  # 不再需要显式下载到临时文件
 from dotenv import load_dotenv
 from telethon import TelegramClient, events, errors
+from telethon.tl.functions.channels import GetMessagesRequest
 from telethon.tl.types import (
+    Channel,
+    InputMessageID,
     InputMediaDocument,
     InputDocument,
     InputMediaPhoto,
     InputPhoto,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageEmpty,
 )
 
-# --- 配置 ---
-# 将基础日志级别设置为 DEBUG，并为 telethon logger 也设置 DEBUG
-# logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # 原配置
-logging.basicConfig(
-    level=logging.INFO,  # 设置为 DEBUG
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)  # 添加 logger 名称
-
-# 可选：如果你只想看 Telethon 的 DEBUG 日志，而保持你自己的代码为 INFO
-# logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-# logging.getLogger('telethon').setLevel(logging.DEBUG)
-
-load_dotenv()
-
-API_ID = os.getenv("API_ID")
-API_HASH = os.getenv("API_HASH")
-SESSION_NAME = os.getenv("SESSION_NAME", "media_downloader_test")
-LOG_CHAT_ID = os.getenv("LOG_CHAT_ID")  # 从 .env 读取目标 LOG_CHAT_ID
-
-if not all([API_ID, API_HASH, LOG_CHAT_ID]):
-    logging.error("请确保 .env 文件中设置了 API_ID, API_HASH, 和 LOG_CHAT_ID")
-    exit(1)
-
-try:
-    # 尝试将 LOG_CHAT_ID 转换为整数，如果失败则保持为字符串 (username)
-    LOG_CHAT_ID = int(LOG_CHAT_ID)
-    logging.info(f"日志频道 ID '{LOG_CHAT_ID}' 将作为数字 ID 处理。")
-except ValueError:
-    logging.info(f"日志频道 ID '{LOG_CHAT_ID}' 不是数字，将作为 username 处理。")
+logger = logging.getLogger(__name__)
 
 # 正则表达式匹配 Telegram 消息链接
-# 支持 t.me/username/123 和 t.me/c/123456789/123 格式
-link_pattern = re.compile(r"https://t\.me/(\w+|c/\d+)/(\d+)")
+# 支持 t.me/username/123 和 t.me/c/123456789/123 格式，整串匹配 (允许末尾的 /)
+_LINK_RE = re.compile(r"https://t\.me/(\w+|c/\d+)/(\d+)/?")
+
+
+# --- 配置 ---
+@dataclass(frozen=True)
+class Config:
+    """脚本运行所需的配置，由 get_config() 在首次调用时从环境变量 / .env 读取"""
+
+    api_id: int
+    api_hash: str
+    log_chat_id: Union[int, str]  # 数字 ID 或 username
+    session: str
+    test_links: Tuple[str, ...]
+    concurrency: int  # 同时处理的链接数量上限
+
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """读取并校验配置，结果在进程内缓存。配置缺失或格式错误时退出脚本。"""
+    load_dotenv()
+
+    api_id = os.getenv("API_ID")
+    api_hash = os.getenv("API_HASH")
+    log_chat_id = os.getenv("LOG_CHAT_ID")  # 从 .env 读取目标 LOG_CHAT_ID
+
+    if not all([api_id, api_hash, log_chat_id]):
+        logger.error("请确保 .env 文件中设置了 API_ID, API_HASH, 和 LOG_CHAT_ID")
+        raise SystemExit(1)
+
+    # 启动时一次性把 API_ID 转为整数，格式错误时立即退出
+    try:
+        api_id = int(api_id)
+    except ValueError:
+        logger.error("API_ID 必须是整数，当前值: '%s'", api_id)
+        raise SystemExit(1)
+
+    try:
+        # 尝试将 LOG_CHAT_ID 转换为整数，如果失败则保持为字符串 (username)
+        log_chat_id = int(log_chat_id)
+        logger.info("日志频道 ID '%s' 将作为数字 ID 处理。", log_chat_id)
+    except ValueError:
+        logger.info("日志频道 ID '%s' 不是数字，将作为 username 处理。", log_chat_id)
+
+    # 同时处理的链接数，用作 asyncio.Semaphore 的初始值，必须 >= 1
+    concurrency = os.getenv("CONCURRENCY", "8")
+    try:
+        concurrency = int(concurrency)
+    except ValueError:
+        logger.error("CONCURRENCY 必须是整数，当前值: '%s'", concurrency)
+        raise SystemExit(1)
+    if concurrency < 1:
+        logger.error("CONCURRENCY 必须大于等于 1，当前值: %s", concurrency)
+        raise SystemExit(1)
+
+    # TEST_MESSAGE_LINKS 支持逗号或换行分隔的多个链接，未配置时回退到单个 TEST_MESSAGE_LINK
+    raw_links = os.getenv("TEST_MESSAGE_LINKS") or os.getenv("TEST_MESSAGE_LINK", "")
+    test_links = tuple(
+        link.strip() for link in re.split(r"[,\n]", raw_links) if link.strip()
+    )
+
+    return Config(
+        api_id=api_id,
+        api_hash=api_hash,
+        log_chat_id=log_chat_id,
+        session=os.getenv("SESSION_NAME", "media_downloader_test"),
+        test_links=test_links,
+        concurrency=concurrency,
+    )
+
 
 # --- Telethon 客户端 ---
-# 使用 system_version='4.16.30-vxCUSTOM' 可能有助于处理某些限制，但通常不需要
-client = TelegramClient(SESSION_NAME, int(API_ID), API_HASH)
+# 在 main() 中根据配置创建
+client: Optional[TelegramClient] = None
+
+
+def _create_client(cfg: Config) -> TelegramClient:
+    """
+    根据配置创建客户端。
+    使用 system_version='4.16.30-vxCUSTOM' 可能有助于处理某些限制，但通常不需要
+    会话保存在 cfg.session.session 文件中，再次运行时无需重新登录
+    """
+    return TelegramClient(cfg.session, cfg.api_id, cfg.api_hash)
+
+
+# call_with_flood_retry 愿意等待的最长 Flood Wait；更长的等待直接抛出，不让脚本挂起数小时
+_MAX_FLOOD_WAIT = 300  # 单位：秒
+
+
+async def call_with_flood_retry(factory, tries: int = 3, max_wait: int = _MAX_FLOOD_WAIT):
+    """
+    调用 factory() 返回的协程，遇到 FloodWaitError 时用 asyncio.sleep 等待后重试，
+    不会阻塞事件循环中的其它链接处理。
+    Telethon 默认已自动等待 60 秒以内的 FloodWait，这里只会遇到更长的等待；
+    超过 max_wait 秒或重试次数用尽时抛出该错误。
+    """
+    for attempt in range(1, tries + 1):
+        try:
+            return await factory()
+        except errors.FloodWaitError as e:
+            if attempt == tries or e.seconds > max_wait:
+                raise
+            wait_seconds = max(0, e.seconds)
+            logger.warning(
+                "触发 Flood Wait，等待 %s 秒后重试 (第 %s/%s 次)",
+                wait_seconds,
+                attempt,
+                tries,
+            )
+            await asyncio.sleep(wait_seconds)
+
+
+# RPC 错误类型 -> 日志模板，模板中可使用 identifier / message_id / log_chat_id / seconds / error
+_ERR_MSGS = {
+    errors.FloodWaitError: "触发 Telegram Flood Wait: 需等待 %(seconds)s 秒 (错误详情: %(error)s)",
+    errors.ChannelPrivateError: (
+        "无法访问私有频道/群组 '%(identifier)s' (消息ID: %(message_id)s)。"
+        "错误详情: 该频道/群组是私有的，需要邀请才能加入。"
+    ),
+    errors.ChatForbiddenError: (
+        "访问被禁止的频道/群组 '%(identifier)s' (消息ID: %(message_id)s)。"
+        "错误详情: 您已被禁止访问或该频道/群组不存在。"
+    ),
+    errors.ChatAdminRequiredError: (
+        "权限不足，无法向目标频道 '%(log_chat_id)s' 发送消息 (消息ID: %(message_id)s)。"
+        "错误详情: %(error)s。需要管理员权限或发送媒体权限。"
+    ),
+    errors.UserNotParticipantError: (
+        "账户未加入源频道/群组 '%(identifier)s' (消息ID: %(message_id)s)。"
+        "错误详情: 需要先加入该频道/群组才能访问消息。"
+    ),
+    errors.MediaEmptyError: (
+        "无法访问或发送来自消息 %(message_id)s 的媒体 (频道: %(identifier)s)。"
+        "错误详情: %(error)s。可能原因: 1) 源频道开启了严格的内容保护 2) 媒体已过期/删除 3) 没有下载权限"
+    ),
+}
+_DEFAULT_RPC_ERR_MSG = (
+    "处理链接时发生 Telegram RPC 错误 (消息ID: %(message_id)s, 频道: %(identifier)s)。"
+    "错误详情: %(error)s"
+)
+
+
+# 已解析的实体缓存，进程生命周期内有效，避免每个链接都重复发起 get_entity 请求
+_entity_cache: dict = {}
+
+
+async def _get_entity_cached(ident):
+    """解析实体并缓存结果。"""
+    entity = _entity_cache.get(ident)
+    if entity is None:
+        entity = await call_with_flood_retry(lambda: client.get_entity(ident))
+        _entity_cache[ident] = entity
+    return entity
+
+
+# 媒体 ID (document.id / photo.id) -> 上次成功发送时使用的 InputMedia
+# 同一媒体再次出现时直接复用，跳过文件信息的提取与对象构造
+_sent_media_cache: dict = {}
+
 
-# 新增：从 .env 读取测试链接
-TEST_MESSAGE_LINK = os.getenv("TEST_MESSAGE_LINK")
+def _build_doc(media: MessageMediaDocument):
+    """根据文档媒体构造 (媒体 ID, InputMediaDocument)"""
+    document = media.document
+    logger.info("文档文件信息 - ID: %s, 访问哈希: %s", document.id, document.access_hash)
+    return document.id, InputMediaDocument(
+        id=InputDocument(
+            id=document.id,
+            access_hash=document.access_hash,
+            file_reference=document.file_reference,
+        )
+    )
+
+
+def _build_photo(media: MessageMediaPhoto):
+    """根据图片媒体构造 (媒体 ID, InputMediaPhoto)"""
+    photo = media.photo
+    logger.info("图片文件信息 - ID: %s, 访问哈希: %s", photo.id, photo.access_hash)
+    return photo.id, InputMediaPhoto(
+        id=InputPhoto(
+            id=photo.id,
+            access_hash=photo.access_hash,
+            file_reference=photo.file_reference,
+        )
+    )
+
+
+# 媒体类型 -> 构造函数，新增媒体类型时在此登记
+_MEDIA_HANDLERS = {
+    MessageMediaDocument: _build_doc,
+    MessageMediaPhoto: _build_photo,
+}
+
+# 媒体类型 -> 取得媒体 ID 所在的属性名
+_MEDIA_ID_ATTRS = {
+    MessageMediaDocument: "document",
+    MessageMediaPhoto: "photo",
+}
+
+
+def _media_id(media):
+    """返回媒体的 document.id / photo.id，不支持的类型返回 None"""
+    attr = _MEDIA_ID_ATTRS.get(type(media))
+    return getattr(getattr(media, attr, None), "id", None) if attr else None
+
+
+async def _send_media_by_reference(target_entity, source_message, caption: str):
+    """根据源消息中的文件 ID 与访问哈希重建媒体对象并发送 (无法转发时的后备方案)"""
+    media = source_message.media
+    media_type = type(media)
+    build = _MEDIA_HANDLERS.get(media_type)
+    if build is None:
+        raise ValueError("不支持的媒体类型")
+
+    media_id = _media_id(media)
+    file = _sent_media_cache.get(media_id) if media_id is not None else None
+    if file is not None:
+        logger.info("媒体 %s 已发送过，复用缓存的 InputMedia。", media_id)
+    else:
+        # 获取媒体文件ID并构造
+        logger.info("获取媒体文件信息 - 媒体类型: %s", media_type.__name__)
+        media_id, file = build(media)
+
+    # 使用文件ID发送媒体
+    await call_with_flood_retry(
+        lambda: client.send_file(
+            target_entity,
+            file=file,
+            caption=caption,
+        )
+    )
+    _sent_media_cache[media_id] = file
+
+
+async def _fetch_source_message(source_entity, message_id: int):
+    """
+    获取源消息。频道直接调用 channels.GetMessagesRequest，跳过 get_messages 的封装处理；
+    其它类型的聊天仍使用 client.get_messages。找不到时返回 None。
+    """
+    if isinstance(source_entity, Channel):
+        result = await call_with_flood_retry(
+            lambda: client(
+                GetMessagesRequest(channel=source_entity, id=[InputMessageID(message_id)])
+            )
+        )
+        message = result.messages[0] if result.messages else None
+        return None if message is None or isinstance(message, MessageEmpty) else message
+    # get_messages 传入单个 ID 时直接返回该消息本身
+    return await call_with_flood_retry(
+        lambda: client.get_messages(source_entity, ids=message_id)
+    )
 
 
-async def process_message_link(link: str):
+async def process_message_link(cfg: Config, link: str) -> bool:
     """处理单个 Telegram 消息链接，下载媒体并发送到 LOG_CHAT_ID"""
-    match = link_pattern.search(link)
+    match = _LINK_RE.fullmatch(link.strip())
 
     if not match:
-        logging.error(f"提供的链接格式无效: {link}")
+        logger.error("提供的链接格式无效: %s", link)
         return False  # 表示处理失败
 
     identifier = match.group(1)  # username or c/channel_id
     message_id = int(match.group(2))
 
-    logging.info(f"开始处理链接: identifier={identifier}, message_id={message_id}")
+    logger.info("开始处理链接: identifier=%s, message_id=%s", identifier, message_id)
 
-    # downloaded_file_path = None  # 不再需要
-    success = False  # 标记处理是否成功
     try:
         # 1. 获取源 Chat Entity
-        logging.info(f"尝试获取源实体: {identifier}")
-        source_entity = await client.get_entity(identifier)
-        source_entity_title = getattr(
-            source_entity, "title", getattr(source_entity, "username", identifier)
+        logger.info("尝试获取源实体: %s", identifier)
+        source_entity = await _get_entity_cached(identifier)
+        source_entity_title = (
+            getattr(source_entity, "title", None)
+            or getattr(source_entity, "username", None)
+            or identifier
         )
-        logging.info(f"成功获取源实体: {source_entity_title}")
-
-        # 2. 获取源消息
-        logging.info(f"尝试获取消息 ID: {message_id} 从 {source_entity_title}")
-        source_messages = await client.get_messages(source_entity, ids=message_id)
-
-        if not source_messages:
-            logging.warning(f"找不到消息 ID {message_id} 在 {source_entity_title}")
+        logger.info("成功获取源实体: %s", source_entity_title)
+
+        # 2. 获取源消息，同时解析目标日志实体 (LOG_CHAT_ID)
+        # 两者互不依赖，并发发出以重叠网络往返；目标只用作发送目的地，InputPeer 即可
+        logger.info("尝试获取消息 ID: %s 从 %s", message_id, source_entity_title)
+        logger.info("尝试获取目标日志实体: %s", cfg.log_chat_id)
+        source_message, target_entity = await asyncio.gather(
+            _fetch_source_message(source_entity, message_id),
+            call_with_flood_retry(lambda: client.get_input_entity(cfg.log_chat_id)),
+            return_exceptions=True,
+        )
+        if isinstance(source_message, BaseException):
+            raise source_message
+        # 取消 (CancelledError) 等非 Exception 的 BaseException 不能当作解析失败处理，照常向上抛出
+        if isinstance(target_entity, BaseException) and not isinstance(target_entity, Exception):
+            raise target_entity
+
+        if not source_message:
+            logger.warning("找不到消息 ID %s 在 %s", message_id, source_entity_title)
             # await event.reply(f"错误：在源 '{source_entity_title}' 中找不到消息 ID {message_id}。") # 不再回复事件
             return False
 
-        source_message = (
-            source_messages  # get_messages with single ID returns the message itself
-        )
-
         # 3. 检查是否有媒体
-        if not source_message.media:
-            logging.info(f"消息 {message_id} 不包含媒体文件。")
+        media = source_message.media
+        if not media:
+            logger.info("消息 %s 不包含媒体文件。", message_id)
             # await event.reply(f"提示：链接指向的消息 {message_id} 不包含媒体文件。") # 不再回复事件
             return False  # 可以认为这不是我们想要处理的情况
 
-        media_type = type(source_message.media).__name__
-        logging.info(f"消息 {message_id} 包含媒体，类型: {media_type}")
+        media_cls = type(media).__name__
+        logger.info("消息 %s 包含媒体，类型: %s", message_id, media_cls)
 
-        # 4. 获取目标 Chat Entity (LOG_CHAT_ID)
-        logging.info(f"尝试获取目标日志实体: {LOG_CHAT_ID}")
-        try:
-            target_entity = await client.get_entity(LOG_CHAT_ID)
-            target_entity_title = getattr(
-                target_entity, "title", getattr(target_entity, "username", LOG_CHAT_ID)
-            )
-            logging.info(f"成功获取目标日志实体: {target_entity_title}")
-        except (ValueError, TypeError) as e:
-            logging.error(f"无法解析配置的 LOG_CHAT_ID '{LOG_CHAT_ID}': {e}")
+        # 4. 检查目标 Chat Entity 的解析结果
+        if isinstance(target_entity, (ValueError, TypeError)):
+            logger.error("无法解析配置的 LOG_CHAT_ID '%s': %s", cfg.log_chat_id, target_entity)
             # await event.reply(f"错误：配置的 LOG_CHAT_ID ('{LOG_CHAT_ID}') 无效或无法访问。请检查 .env 文件。") # 不再回复事件
             return False
-        except Exception as e:
-            logging.error(f"获取目标日志实体时发生意外错误: {e}")
+        if isinstance(target_entity, BaseException):
+            logger.error("获取目标日志实体时发生意外错误: %s", target_entity)
             # await event.reply(f"错误：无法访问目标日志频道 '{LOG_CHAT_ID}'。") # 不再回复事件
             return False
+        target_entity_title = cfg.log_chat_id
+        logger.info("成功获取目标日志实体: %s", target_entity_title)
 
         # 5. 直接尝试发送媒体对象，而不是下载
-        logging.info(f"尝试直接发送消息 {message_id} 的媒体到 {target_entity_title}")
+        logger.info("尝试直接发送消息 %s 的媒体到 %s", message_id, target_entity_title)
         try:
             caption = (
                 f"媒体来源: {source_entity_title} (消息ID: {message_id})\n"
                 f"原始链接: https://t.me/{identifier}/{message_id}"
             )
 
-            logging.info(
-                f"准备发送媒体 - 类型: {type(source_message.media)}, 大小: {getattr(source_message.media, 'size', '未知')} bytes"
+            logger.info(
+                "准备发送媒体 - 类型: %s, 大小: %s bytes",
+                media_cls,
+                getattr(media, "size", "未知"),
             )
 
-            # 获取媒体文件ID并发送
-            logging.info(f"获取媒体文件信息 - 媒体类型: {type(source_message.media).__name__}")
-            if hasattr(source_message.media, "document"):
-                file_id = source_message.media.document.id
-                access_hash = source_message.media.document.access_hash
-                logging.info(f"文档文件信息 - ID: {file_id}, 访问哈希: {access_hash}")
-                file_reference = source_message.media.document.file_reference
-                file = InputMediaDocument(
-                    id=InputDocument(
-                        id=file_id,
-                        access_hash=access_hash,
-                        file_reference=file_reference,
+            try:
+                # 服务端直接转发，无需重建媒体对象，也不受 file_reference 过期影响
+                forwarded = await call_with_flood_retry(
+                    lambda: client.forward_messages(
+                        target_entity,
+                        source_message,
+                        from_peer=source_entity,
+                        drop_author=True,
                     )
                 )
-            elif hasattr(source_message.media, "photo"):
-                file_id = source_message.media.photo.id
-                access_hash = source_message.media.photo.access_hash
-                logging.info(f"图片文件信息 - ID: {file_id}, 访问哈希: {access_hash}")
-                file_reference = source_message.media.photo.file_reference
-                file = InputMediaPhoto(
-                    id=InputPhoto(
-                        id=file_id,
-                        access_hash=access_hash,
-                        file_reference=file_reference,
+                # 来源说明以回复的形式补发在转发的消息下方
+                await call_with_flood_retry(
+                    lambda: client.send_message(
+                        target_entity, caption, reply_to=forwarded.id
                     )
                 )
-            else:
-                raise ValueError("不支持的媒体类型")
-
-            # 使用文件ID发送媒体
-            await client.send_file(
-                target_entity,
-                file=file,
-                caption=caption,
-            )
-            logging.info(f"成功发送媒体到 {target_entity_title}")
+            except errors.ChatForwardsRestrictedError:
+                logger.info("源聊天禁止转发，改为按文件引用重新发送消息 %s 的媒体。", message_id)
+                try:
+                    await _send_media_by_reference(target_entity, source_message, caption)
+                except errors.FileReferenceExpiredError:
+                    # file_reference 已过期：重新获取消息以刷新引用，只重试一次
+                    logger.info("消息 %s 的 file_reference 已过期，刷新后重试一次。", message_id)
+                    _sent_media_cache.pop(_media_id(source_message.media), None)
+                    source_message = await _fetch_source_message(source_entity, message_id)
+                    if not source_message or not source_message.media:
+                        raise
+                    await _send_media_by_reference(target_entity, source_message, caption)
+            logger.info("成功发送媒体到 %s", target_entity_title)
         except Exception as e:
-            logging.error(
-                f"发送媒体时发生错误 (消息ID: {message_id}, 目标: {target_entity_title})。"
-                f"媒体类型: {type(source_message.media).__name__}, 错误详情: {str(e)}"
+            logger.error(
+                "发送媒体时发生错误 (消息ID: %s, 目标: %s)。媒体类型: %s, 错误详情: %s",
+                message_id,
+                target_entity_title,
+                media_cls,
+                e,
             )
             raise  # 重新抛出异常以便外层捕获处理
 
-        logging.info(f"成功将媒体从消息 {message_id} 发送到 {target_entity_title}")
+        logger.info("成功将媒体从消息 %s 发送到 %s", message_id, target_entity_title)
         # await event.reply(f"成功将链接指向的媒体发送到日志频道 '{target_entity_title}'。") # 不再回复
-        success = True  # 标记成功
-
-    except errors.FloodWaitError as e:
-        logging.error(
-            f"触发 Telegram Flood Wait: 需等待 {e.seconds} 秒 (错误详情: {str(e)})"
-        )
-    except errors.ChannelPrivateError:
-        logging.error(
-            f"无法访问私有频道/群组 '{identifier}' (消息ID: {message_id})。错误详情: 该频道/群组是私有的，需要邀请才能加入。"
-        )
-    except errors.ChatForbiddenError:
-        logging.error(
-            f"访问被禁止的频道/群组 '{identifier}' (消息ID: {message_id})。错误详情: 您已被禁止访问或该频道/群组不存在。"
-        )
-    except errors.ChatAdminRequiredError as e:
-        logging.error(
-            f"权限不足，无法向目标频道 '{LOG_CHAT_ID}' 发送消息 (消息ID: {message_id})。"
-            f"错误详情: {str(e)}。需要管理员权限或发送媒体权限。"
-        )
-    except errors.UserNotParticipantError:
-        logging.error(
-            f"账户未加入源频道/群组 '{identifier}' (消息ID: {message_id})。错误详情: 需要先加入该频道/群组才能访问消息。"
-        )
-    except errors.MediaUnavailableError as e:
-        logging.error(
-            f"无法访问或发送来自消息 {message_id} 的媒体 (频道: {identifier})。"
-            f"错误详情: {str(e)}。可能原因: 1) 源频道开启了严格的内容保护 2) 媒体已过期/删除 3) 没有下载权限"
-        )
+        return True
+
+    except errors.RPCError as e:
+        details = {
+            "identifier": identifier,
+            "message_id": message_id,
+            "log_chat_id": cfg.log_chat_id,
+            "seconds": getattr(e, "seconds", None),
+            "error": e,
+        }
+        logger.error(_ERR_MSGS.get(type(e), _DEFAULT_RPC_ERR_MSG), details)
+        return False
     except (ValueError, TypeError) as e:
-        logging.error(
-            f"无效的标识符格式 '{identifier}' 或 '{LOG_CHAT_ID}' (消息ID: {message_id})。"
-            f"错误详情: {str(e)}。请检查: 1) 链接格式是否正确 2) LOG_CHAT_ID 是否有效"
+        logger.error(
+            "无效的标识符格式 '%s' 或 '%s' (消息ID: %s)。错误详情: %s。请检查: 1) 链接格式是否正确 2) LOG_CHAT_ID 是否有效",
+            identifier,
+            cfg.log_chat_id,
+            message_id,
+            e,
         )
+        return False
     except Exception as e:
-        logging.exception(
-            f"处理链接时发生未预期的错误 (消息ID: {message_id}, 频道: {identifier})。"
-            f"错误类型: {type(e).__name__}, 错误详情: {str(e)}"
+        # 完整的堆栈只在 DEBUG 级别输出，平时只记录错误类型与详情
+        log = logger.exception if logger.isEnabledFor(logging.DEBUG) else logger.error
+        log(
+            "处理链接时发生未预期的错误 (消息ID: %s, 频道: %s)。错误类型: %s, 错误详情: %s",
+            message_id,
+            identifier,
+            type(e).__name__,
+            e,
         )
         # await event.reply(f"处理链接时发生未知错误: {e}") # 不再回复
-    finally:
-        # 不再需要清理临时文件
-        # if downloaded_file_path and os.path.exists(downloaded_file_path):
-        #     try:
-        #         os.remove(downloaded_file_path)
-        #         logging.info(f"已删除临时文件: {downloaded_file_path}")
-        #     except OSError as e:
-        #         logging.error(f"删除临时文件 {downloaded_file_path} 时出错: {e}")
-        return success  # 返回处理结果
-
-
-async def main():
+        return False
+
+
+async def main(cfg: Optional[Config] = None):
     """主函数，启动客户端，处理配置的链接，然后退出"""
-    logging.info("媒体下载转发脚本（单次运行模式）启动...")
+    global client
+
+    logger.info("媒体下载转发脚本（单次运行模式）启动...")
+    if cfg is None:
+        cfg = get_config()
 
-    if not TEST_MESSAGE_LINK:
-        logging.error("错误：未在 .env 文件中配置 TEST_MESSAGE_LINK。")
+    if not cfg.test_links:
+        logger.error("错误：未在 .env 文件中配置 TEST_MESSAGE_LINKS 或 TEST_MESSAGE_LINK。")
         return
 
-    logging.info(f"目标处理链接: {TEST_MESSAGE_LINK}")
-    logging.info(f"媒体将发送到日志频道: {LOG_CHAT_ID}")
+    logger.info("目标处理链接 (%s 个): %s", len(cfg.test_links), cfg.test_links)
+    logger.info("媒体将发送到日志频道: %s", cfg.log_chat_id)
 
+    client = _create_client(cfg)
     async with client:  # 使用 async with 确保客户端正确关闭
-        logging.info("客户端连接中...")
+        logger.info("客户端连接中...")
         # start() 会自动处理登录
         await client.start()
-        logging.info("客户端已连接并登录。")
+        logger.info("客户端已连接并登录。")
 
-        # 预先检查是否能访问 LOG_CHAT_ID
+        # 预先检查是否能访问 LOG_CHAT_ID：先查本地会话缓存，查不到时再完整解析
         try:
-            await client.get_entity(LOG_CHAT_ID)
-            logging.info(f"成功验证可以访问目标日志频道: {LOG_CHAT_ID}")
+            try:
+                await client.get_input_entity(cfg.log_chat_id)
+            except (ValueError, TypeError):
+                await _get_entity_cached(cfg.log_chat_id)
+            logger.info("成功验证可以访问目标日志频道: %s", cfg.log_chat_id)
         except Exception as e:
-            logging.error(f"无法访问配置的目标 LOG_CHAT_ID ('{LOG_CHAT_ID}'): {e}")
-            logging.error(
+            logger.error("无法访问配置的目标 LOG_CHAT_ID ('%s'): %s", cfg.log_chat_id, e)
+            logger.error(
                 "请检查 LOG_CHAT_ID 是否正确，以及该账号是否有权访问。脚本将退出。"
             )
             return  # 无法访问目标，直接退出
 
-        # 处理配置的链接
-        logging.info(f"开始处理配置的链接: {TEST_MESSAGE_LINK}")
-        success = await process_message_link(TEST_MESSAGE_LINK)
+        # 并发处理配置的链接，由信号量限制同时进行的数量
+        logger.info("开始处理配置的链接，并发数: %s", cfg.concurrency)
+        sem = asyncio.Semaphore(cfg.concurrency)
 
-        if success:
-            logging.info("链接处理成功完成。")
-        else:
-            logging.error("链接处理失败。请检查日志获取详细信息。")
+        async def bounded(link: str):
+            async with sem:
+                return await process_message_link(cfg, link)
 
-    logging.info("脚本执行完毕，客户端已断开连接。")
+        results = await asyncio.gather(
+            *(bounded(link) for link in cfg.test_links), return_exceptions=True
+        )
+
+        for link, result in zip(cfg.test_links, results):
+            if result is True:
+                logger.info("链接处理成功完成: %s", link)
+            elif isinstance(result, BaseException):
+                logger.error("链接处理时抛出异常: %s，错误: %r", link, result)
+            else:
+                logger.error("链接处理失败: %s。请检查日志获取详细信息。", link)
+
+    logger.info("脚本执行完毕，客户端已断开连接。")
 
 
 if __name__ == "__main__":
-    # 使用 client.loop.run_until_complete 运行 main coroutine
-    client.loop.run_until_complete(main())
+    # 将基础日志级别设置为 INFO，并在格式中包含 logger 名称
+    # 如需查看 Telethon 的 DEBUG 日志: logging.getLogger('telethon').setLevel(logging.DEBUG)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    # 安装了 uvloop 时使用基于 libuv 的事件循环，否则使用默认事件循环
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        uvloop.install()
+    asyncio.run(main())
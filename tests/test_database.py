@@ -0,0 +1,116 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from telegram_logger.data.database import DatabaseManager
+from telegram_logger.data.models import Message
+
+
+def make_message(msg_id: int, chat_id: int = 1, **kwargs) -> Message:
+    """构造一条用于测试的文本消息"""
+    fields = dict(
+        id=msg_id,
+        from_id=10,
+        chat_id=chat_id,
+        msg_type=1,
+        msg_text=f"消息 {msg_id}",
+        media_path=None,
+        noforwards=False,
+        self_destructing=False,
+        created_time=datetime(2024, 1, 1),
+    )
+    fields.update(kwargs)
+    return Message(**fields)
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "db" / "messages.db"))
+    yield manager
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_get_messages_by_ids_keeps_earliest_row(db):
+    """测试批量查询每个 ID 只返回最早的记录，未找到的 ID 不出现在结果中"""
+    original = make_message(1, msg_text="原始")
+    db.save_message(original)
+    db.save_message(make_message(
+        1,
+        msg_text="编辑后",
+        created_time=original.created_time + timedelta(minutes=1),
+        edited_time=original.created_time + timedelta(minutes=1),
+    ))
+    db.save_message(make_message(2))
+
+    found = await db.get_messages_by_ids([1, 2, 3])
+
+    assert set(found) == {1, 2}
+    assert found[1].msg_text == "原始"
+
+
+@pytest.mark.asyncio
+async def test_get_messages_by_ids_chunks_large_requests(db, monkeypatch):
+    """测试 ID 数量超过单次参数上限时分块查询，且不丢失任何一块的结果"""
+    total = DatabaseManager.MAX_QUERY_PARAMS * 2 + 1
+    for msg_id in range(1, total + 1):
+        db.save_message(make_message(msg_id))
+
+    statements = []
+    db_path = db.db_path
+
+    real_connect = sqlite3.connect
+
+    def tracing_connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        if args and args[0] == db_path:
+            conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, "connect", tracing_connect)
+
+    found = await db.get_messages_by_ids(list(range(1, total + 1)))
+
+    assert set(found) == set(range(1, total + 1))
+    selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 3
+
+
+@pytest.mark.asyncio
+async def test_get_messages_by_ids_empty(db):
+    """测试空 ID 列表直接返回空结果"""
+    assert await db.get_messages_by_ids([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_save_message_wakes_only_matching_waiter(db):
+    """测试写入消息只唤醒等待该 ID 的协程，其他等待者继续等待直到超时"""
+    wait_1 = asyncio.create_task(db.wait_for_message(1, timeout=1))
+    wait_2 = asyncio.create_task(db.wait_for_message(2, timeout=0.05))
+    await asyncio.sleep(0)
+    assert set(db._row_waiters) == {1, 2}
+
+    db.save_message(make_message(1))
+
+    assert await wait_1 is True
+    assert await wait_2 is False
+    assert db._row_waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_wait_removes_waiter(db):
+    """测试等待被取消时从等待列表中移除，同一 ID 的其他等待者不受影响"""
+    cancelled = asyncio.create_task(db.wait_for_message(1, timeout=1))
+    kept = asyncio.create_task(db.wait_for_message(1, timeout=1))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert len(db._row_waiters[1]) == 1
+
+    db._notify_new_rows([1])
+    assert await kept is True
+    assert db._row_waiters == {}
@@ -0,0 +1,254 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from telethon.tl.types import MessageEntityBold, MessageEntityCode
+
+from telegram_logger.handlers import output_handler
+from telegram_logger.handlers.output_handler import OutputHandler
+
+
+def make_handler(**kwargs) -> OutputHandler:
+    """创建未连接客户端的 OutputHandler，LogSender 用 AsyncMock 代替"""
+    handler = OutputHandler(db=None, log_chat_id=-100, ignored_ids=set(), **kwargs)
+    handler.log_sender = AsyncMock()
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_batched_logs_are_parsed_per_entry():
+    """测试合并发送时每条日志单独解析，不成对的反引号不会影响下一条日志"""
+    handler = make_handler()
+
+    await handler._enqueue_log("😀 **一** 未闭合的 ` 反引号")
+    await handler._enqueue_log("**二** `code`")
+    await handler._flush()
+
+    handler.log_sender.send_message.assert_awaited_once()
+    args, kwargs = handler.log_sender.send_message.call_args
+    text = args[0]
+    entities = kwargs["formatting_entities"]
+    assert "parse_mode" not in kwargs
+    assert text == "😀 一 未闭合的 ` 反引号" + output_handler._LOG_BATCH_SEPARATOR + "二 code"
+
+    # 实体偏移以 UTF-16 码元计算，第二条日志的实体按前文长度平移
+    utf16 = text.encode("utf-16-le")
+    spans = [
+        (type(e), utf16[e.offset * 2:(e.offset + e.length) * 2].decode("utf-16-le"))
+        for e in entities
+    ]
+    assert spans == [
+        (MessageEntityBold, "一"),
+        (MessageEntityBold, "二"),
+        (MessageEntityCode, "code"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_budget_counts_utf16_units(monkeypatch):
+    """测试合并上限按 UTF-16 码元计算：emoji 占两个码元"""
+    monkeypatch.setattr(output_handler, "_LOG_BATCH_MAX_UNITS", 30)
+    handler = make_handler()
+
+    # 每条 10 个 emoji = 10 个字符，但占 20 个 UTF-16 码元，两条合并会超出上限
+    await handler._enqueue_log("😀" * 10)
+    await handler._enqueue_log("😀" * 10)
+    await handler._flush()
+
+    sent = [call.args[0] for call in handler.log_sender.send_message.call_args_list]
+    assert sent == ["😀" * 10, "😀" * 10]
+
+
+@pytest.mark.asyncio
+async def test_missing_ids_skip_repeated_single_lookup():
+    """测试批量查询未命中的 ID 直接等待写入通知，只再查询一次"""
+    handler = make_handler()
+    handler.db = MagicMock()
+    handler.db.wait_for_message = AsyncMock(return_value=False)
+    handler.db.get_message_by_id_async = AsyncMock(return_value=None)
+
+    result = await handler._get_message_from_db_with_retry(
+        42, chat_id=1, skip_initial_lookup=True
+    )
+
+    assert result is None
+    handler.db.wait_for_message.assert_awaited_once_with(42, timeout=0.5)
+    handler.db.get_message_by_id_async.assert_awaited_once_with(42)
+
+
+class FakeClock:
+    """可手动推进的 time.monotonic 替身"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    # 只替换 output_handler 模块中的 time，不影响事件循环使用的 time.monotonic
+    monkeypatch.setattr(output_handler, "time", fake)
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_deletion_rate_limit_weights_previous_window(clock):
+    """测试跨过一个窗口后，上一窗口的计数按重叠比例计入估算值"""
+    handler = make_handler(deletion_rate_limit_threshold=5, deletion_rate_limit_window=10)
+
+    for _ in range(5):
+        assert await handler._apply_deletion_rate_limit()
+
+    # 进入下一窗口的一半：估算值 = 5 * 0.5 + 当前窗口计数
+    clock.now += 15
+    assert await handler._apply_deletion_rate_limit()  # 3.5
+    assert await handler._apply_deletion_rate_limit()  # 4.5
+    assert not await handler._apply_deletion_rate_limit()  # 5.5，触发暂停
+    assert handler._rate_limit_paused_until == clock.now + 5
+
+    # 暂停期内直接限制，暂停结束后恢复
+    clock.now += 4
+    assert not await handler._apply_deletion_rate_limit()
+    clock.now += 1
+    assert await handler._apply_deletion_rate_limit()
+    assert handler._rate_limit_paused_until is None
+
+
+@pytest.mark.asyncio
+async def test_deletion_rate_limit_resets_after_several_windows(clock):
+    """测试跨过多个窗口后，上一窗口的计数被清零"""
+    handler = make_handler(deletion_rate_limit_threshold=5, deletion_rate_limit_window=10)
+
+    for _ in range(5):
+        assert await handler._apply_deletion_rate_limit()
+
+    clock.now += 25
+    for _ in range(5):
+        assert await handler._apply_deletion_rate_limit()
+    assert handler._deletion_prev_count == 0
+    assert not await handler._apply_deletion_rate_limit()
+
+
+@pytest.mark.asyncio
+async def test_deletion_rate_limit_with_non_positive_window(clock):
+    """测试窗口长度不大于 0 时每次只计当前事件，不会除零"""
+    handler = make_handler(deletion_rate_limit_threshold=1, deletion_rate_limit_window=0)
+
+    for _ in range(10):
+        assert await handler._apply_deletion_rate_limit()
+    assert handler._deletion_window_start is None
+
+    handler = make_handler(deletion_rate_limit_threshold=0, deletion_rate_limit_window=-5)
+    assert not await handler._apply_deletion_rate_limit()
+
+
+def make_event(chat_id: int, msg_id: int, media=None) -> SimpleNamespace:
+    """构造只包含排序逻辑所需字段的消息事件"""
+    message = SimpleNamespace(id=msg_id, chat_id=chat_id, media=media)
+    return SimpleNamespace(chat_id=chat_id, message=message)
+
+
+def make_ordering_handler():
+    """
+    创建用于测试发送顺序的 OutputHandler。
+    媒体发送与真实实现一样先发出缓冲的文本日志，然后等待测试放行再通过 LogSender 发送。
+    """
+    handler = make_handler()
+    handler._media_sem = asyncio.Semaphore(4)
+    handler._should_forward = lambda event: True
+    handler._format_output_message = AsyncMock(
+        side_effect=lambda kind, message: f"{kind} {message.chat_id}:{message.id}"
+    )
+    gates = {}
+
+    async def fake_send(text, message):
+        if not message.media:
+            await handler._enqueue_log(text)
+            return
+        await handler._flush()
+        await gates.setdefault(message.id, asyncio.Event()).wait()
+        await handler.log_sender.send_message(text, file=message.media)
+
+    handler._send_message_with_media = fake_send
+    return handler, gates
+
+
+def sent_texts(handler) -> list:
+    return [call.args[0] for call in handler.log_sender.send_message.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_text_logs_wait_for_same_chat_media_only():
+    """测试文本与编辑日志排在同一聊天已排队的媒体之后，其他聊天不被阻塞"""
+    handler, gates = make_ordering_handler()
+
+    await handler._process_new_message(make_event(1, 10, media="photo"))
+    text_a = asyncio.create_task(handler._process_new_message(make_event(1, 11)))
+    edit_a = asyncio.create_task(handler._process_edited_message(make_event(1, 10)))
+    await asyncio.sleep(0)
+
+    # 聊天 2 的文本日志不等待聊天 1 的媒体
+    await handler._process_new_message(make_event(2, 20))
+    await handler._flush()
+    assert sent_texts(handler) == ["新消息 2:20"]
+    assert not text_a.done() and not edit_a.done()
+
+    gates.setdefault(10, asyncio.Event()).set()
+    await asyncio.gather(text_a, edit_a)
+    await handler._flush()
+
+    assert sent_texts(handler) == [
+        "新消息 2:20",
+        "新消息 1:10",
+        "新消息 1:11" + output_handler._LOG_BATCH_SEPARATOR + "编辑消息 1:10",
+    ]
+    assert handler._chat_tails == {}
+
+
+@pytest.mark.asyncio
+async def test_same_chat_media_sent_in_order():
+    """测试同一聊天的媒体依次发送，不同聊天的媒体并发发送"""
+    handler, gates = make_ordering_handler()
+
+    await handler._process_new_message(make_event(1, 10, media="photo"))
+    await handler._process_new_message(make_event(1, 11, media="photo"))
+    await handler._process_new_message(make_event(2, 20, media="photo"))
+
+    # 后排队的先放行：聊天 1 的第二条仍须等第一条，聊天 2 不受影响
+    gates.setdefault(11, asyncio.Event()).set()
+    gates.setdefault(20, asyncio.Event()).set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert sent_texts(handler) == ["新消息 2:20"]
+
+    gates.setdefault(10, asyncio.Event()).set()
+    await asyncio.gather(*handler._inflight)
+    assert sent_texts(handler) == ["新消息 2:20", "新消息 1:10", "新消息 1:11"]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_media_then_buffer():
+    """测试 shutdown 先等待发送中的媒体，再发出缓冲的文本日志并停止定时任务"""
+    handler, gates = make_ordering_handler()
+    handler._flusher_task = asyncio.create_task(handler._flusher())
+
+    await handler._process_new_message(make_event(1, 10, media="photo"))
+    await asyncio.sleep(0)
+    await handler._process_new_message(make_event(2, 20))
+
+    shutdown = asyncio.create_task(handler.shutdown())
+    await asyncio.sleep(0)
+    assert not shutdown.done()
+    assert sent_texts(handler) == []
+
+    gates.setdefault(10, asyncio.Event()).set()
+    await shutdown
+
+    assert sent_texts(handler) == ["新消息 1:10", "新消息 2:20"]
+    assert handler._flusher_task is None
+    assert not handler._inflight